@@ -0,0 +1,13 @@
+import logging
+from database import Database
+
+# Fill in the per-user download counters from the existing downloads log.
+# Run once with the bots stopped: python backfill_user_stats.py
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+if __name__ == "__main__":
+    db = Database()
+    try:
+        db.backfill_user_counters()
+    finally:
+        db.close()
@@ -0,0 +1,401 @@
+"""
+Load test of a single bot process.
+
+Drives the real download_media handler of telethon_bot.py or bot.py with
+synthetic Telegram updates: many users, repeated links, carousels and large
+videos. Telegram is replaced by an in-process fake transport and Instagram
+and its CDN by the replay server, so nothing leaves the machine. The
+concurrency is stepped up level by level to find where throughput stops
+growing.
+
+    python bench/load_generator.py --bot telethon --levels 1,4,16,64 --output load.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import importlib
+import itertools
+from types import SimpleNamespace
+from datetime import datetime
+
+from replay_benchmark import ReplayServer, install_replay_adapter, benchmark_env, percentile, git_revision, REPO_DIR
+
+CDN_HOST = "scontent-load.cdninstagram.com"
+
+# Media served by the stand-in CDN: (path, size in bytes)
+IMAGES = [(f"/v/t51.2885-15/load_image_{i}.jpg", 200 * 1024) for i in range(10)]
+VIDEOS = [(f"/o1/v/t16/load_video_{i}.mp4", 4 * 1024 * 1024) for i in range(4)]
+LARGE_VIDEO = ("/o1/v/t16/load_large_video.mp4", 80 * 1024 * 1024)
+
+# Share of each kind of post among the generated links
+POST_MIX = [("image", 0.4), ("carousel", 0.3), ("video", 0.2), ("large_video", 0.1)]
+
+def cdn_url(path):
+    return f"https://{CDN_HOST}{path}"
+
+def post_page(shortcode, media):
+    """Render a post page carrying its media in window._sharedData, like Instagram's own pages"""
+    if len(media) == 1:
+        kind, url = media[0]
+        node = {"__typename": "GraphVideo" if kind == "video" else "GraphImage", "shortcode": shortcode, "is_video": kind == "video"}
+        node["video_url" if kind == "video" else "display_url"] = url
+    else:
+        node = {
+            "__typename": "GraphSidecar",
+            "shortcode": shortcode,
+            "edge_sidecar_to_children": {"edges": [
+                {"node": {"is_video": kind == "video", "video_url" if kind == "video" else "display_url": url}}
+                for kind, url in media
+            ]}
+        }
+    data = json.dumps({"entry_data": {"PostPage": [{"graphql": {"shortcode_media": node}}]}}, separators=(',', ':')).replace('/', '\\/')
+    return f'<!DOCTYPE html><html><head><title>{shortcode}</title></head><body><script type="text/javascript">window._sharedData = {data};</script></body></html>'
+
+def generate_posts(count, seed):
+    """Generate post links of every kind and the fixture routes that serve them"""
+    rng = random.Random(seed)
+    routes = [{"host": "*", "path": path, "size": size, "content_type": "image/jpeg"} for path, size in IMAGES]
+    routes += [{"host": "*", "path": path, "size": size, "content_type": "video/mp4"} for path, size in VIDEOS + [LARGE_VIDEO]]
+
+    links = []
+    kinds, weights = zip(*POST_MIX)
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        shortcode = f"LOAD{kind[0].upper()}{i:07d}"
+        if kind == "image":
+            media = [("image", cdn_url(rng.choice(IMAGES)[0]))]
+        elif kind == "video":
+            media = [("video", cdn_url(rng.choice(VIDEOS)[0]))]
+        elif kind == "large_video":
+            media = [("video", cdn_url(LARGE_VIDEO[0]))]
+        else:
+            items = rng.sample(IMAGES, rng.randint(2, 6))
+            media = [("image", cdn_url(path)) for path, _ in items]
+            if rng.random() < 0.5:
+                media.append(("video", cdn_url(rng.choice(VIDEOS)[0])))
+        # The handlers pass links on without the trailing slash
+        path = f"/{'reel' if 'video' in kind else 'p'}/{shortcode}"
+        routes.append({"host": "www.instagram.com", "path": path, "text": post_page(shortcode, media), "content_type": "text/html; charset=utf-8"})
+        links.append((kind, f"https://www.instagram.com{path}"))
+    return links, {"dir": REPO_DIR, "cases": [url for _, url in links], "routes": routes}
+
+def update_stream(links, count, repeat_rate, rng):
+    """Pick the links of count updates; some repeat a recently sent link, like a post shared in many chats"""
+    fresh = itertools.cycle(links)
+    recent = []
+    for _ in range(count):
+        if recent and rng.random() < repeat_rate:
+            yield rng.choice(recent)
+        else:
+            link = next(fresh)
+            recent = (recent + [link])[-20:]
+            yield link
+
+class FakeTransport:
+    """
+    In-process stand-in for Telegram: counts what the handlers send and
+    optionally paces uploads to a given bandwidth
+    """
+    def __init__(self, upload_bandwidth=0):
+        self.upload_bandwidth = upload_bandwidth
+        self.first_media = {}
+        self.messages = 0
+        self.bytes_uploaded = 0
+        self._ids = itertools.count(1)
+
+    async def upload(self, size):
+        self.bytes_uploaded += size
+        if self.upload_bandwidth:
+            await asyncio.sleep(size / self.upload_bandwidth)
+
+    async def upload_path(self, path):
+        await self.upload(os.path.getsize(path) if os.path.exists(path) else 0)
+
+    def message(self, chat_id, media_type=None):
+        """Record a sent message and build what the client library would return for it"""
+        self.messages += 1
+        message_id = next(self._ids)
+        if media_type:
+            self.first_media.setdefault(chat_id, time.perf_counter())
+        media = SimpleNamespace(id=message_id, access_hash=0, file_reference=b"", file_id=f"fake-{message_id}")
+        return SimpleNamespace(
+            id=message_id,
+            chat_id=chat_id,
+            photo=media if media_type == "photo" else None,
+            video=media if media_type == "video" else None,
+            document=media if media_type in ("video", "document") else None
+        )
+
+def media_type_of(name):
+    name = str(name).lower()
+    if name.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+        return "photo"
+    if name.endswith(('.mp4', '.mov', '.avi')):
+        return "video"
+    return "document"
+
+class FakeTelethonClient:
+    """The parts of TelegramClient the Telethon handlers use"""
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def upload_file(self, file, file_size=None, file_name=None, progress_callback=None, **kwargs):
+        if isinstance(file, str):
+            await self.transport.upload_path(file)
+        else:
+            size = 0
+            while True:
+                data = file.read(512 * 1024)
+                if asyncio.iscoroutine(data):
+                    data = await data
+                if not data:
+                    break
+                size += len(data)
+            await self.transport.upload(size)
+        return SimpleNamespace(name=file_name or os.path.basename(str(getattr(file, 'name', file))))
+
+    async def __call__(self, request):
+        # Upload part requests of the parallel uploader
+        await self.transport.upload(len(getattr(request, 'bytes', b"")))
+        return True
+
+    async def send_file(self, entity, file, **kwargs):
+        files = file if isinstance(file, list) else [file]
+        messages = []
+        for item in files:
+            if isinstance(item, str):
+                await self.transport.upload_path(item)
+            # Album videos come wrapped in InputMediaUploadedDocument, named by the file inside
+            messages.append(self.transport.message(entity, media_type_of(getattr(getattr(item, 'file', item), 'name', item))))
+        return messages if isinstance(file, list) else messages[0]
+
+    async def edit_message(self, *args, **kwargs):
+        return self.transport.message(None)
+
+class FakeTelethonEvent:
+    """An incoming Telethon NewMessage event"""
+    def __init__(self, transport, chat_id, text):
+        self.transport = transport
+        self.chat_id = chat_id
+        self.text = text
+
+    async def get_sender(self):
+        return SimpleNamespace(id=self.chat_id, username=f"load{self.chat_id}", first_name="Load")
+
+    async def respond(self, text, **kwargs):
+        return self.transport.message(self.chat_id)
+
+class FakePyrogramMessage:
+    """An incoming Pyrogram message, and the replies the handler sends through it"""
+    def __init__(self, transport, chat_id, text=None):
+        self.transport = transport
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = SimpleNamespace(id=chat_id, username=f"load{chat_id}", first_name="Load")
+
+    def _sent(self, media_type=None):
+        sent = FakePyrogramMessage(self.transport, self.chat_id)
+        for name, value in vars(self.transport.message(self.chat_id, media_type)).items():
+            if name != "chat_id":
+                setattr(sent, name, value)
+        return sent
+
+    async def reply(self, text, **kwargs):
+        return self._sent()
+
+    async def edit(self, text, **kwargs):
+        return self._sent()
+
+    async def _reply_media(self, media, media_type):
+        if isinstance(media, str):
+            await self.transport.upload_path(media)
+        return self._sent(media_type)
+
+    async def reply_photo(self, photo, **kwargs):
+        return await self._reply_media(photo, "photo")
+
+    async def reply_video(self, video, **kwargs):
+        return await self._reply_media(video, "video")
+
+    async def reply_document(self, document, **kwargs):
+        return await self._reply_media(document, "document")
+
+    async def reply_media_group(self, media, **kwargs):
+        return [await self._reply_media(item.media, media_type_of(item.media)) for item in media]
+
+class LoopMonitor:
+    """Samples event loop lag and download pool queue depths while a level runs"""
+    def __init__(self, download_pool, interval=0.05):
+        self.download_pool = download_pool
+        self.interval = interval
+        self.lags = []
+        self.queued = []
+        self.in_flight = []
+        self.running = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+            stats = self.download_pool.stats()
+            self.queued.append(stats["queued"])
+            self.in_flight.append(stats["in_flight"])
+            self.running.append(stats["running"])
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None
+    }
+
+async def run_level(bot_module, bot_name, transport, links, concurrency, updates, repeat_rate, rng, chat_ids):
+    """Send updates through the handler with at most concurrency of them in progress at once"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    first_media = []
+    failures = 0
+    coalesced_before = bot_module.download_pool.coalesced
+    uploaded_before = transport.bytes_uploaded
+
+    async def handle(url):
+        nonlocal failures
+        chat_id = next(chat_ids)
+        async with semaphore:
+            start = time.perf_counter()
+            if bot_name == "telethon":
+                await bot_module.download_media(FakeTelethonEvent(transport, chat_id, url))
+            else:
+                await bot_module.download_media(None, FakePyrogramMessage(transport, chat_id, url))
+            latencies.append(time.perf_counter() - start)
+        first = transport.first_media.pop(chat_id, None)
+        if first is None:
+            failures += 1
+        else:
+            first_media.append(first - start)
+
+    monitor = LoopMonitor(bot_module.download_pool)
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*[handle(url) for _, url in update_stream(links, updates, repeat_rate, rng)])
+    wall = time.perf_counter() - started
+    await monitor.stop()
+
+    return {
+        "concurrency": concurrency,
+        "updates": updates,
+        "wall_seconds": wall,
+        "throughput": updates / wall if wall else None,
+        "failures": failures,
+        "handler_latency": summarize(latencies),
+        "time_to_first_media": summarize(first_media),
+        "event_loop_lag": summarize(monitor.lags),
+        "queue_depth": {
+            "queued_max": max(monitor.queued, default=0),
+            "in_flight_max": max(monitor.in_flight, default=0),
+            "running_max": max(monitor.running, default=0)
+        },
+        "coalesced": bot_module.download_pool.coalesced - coalesced_before,
+        "bytes_uploaded": transport.bytes_uploaded - uploaded_before
+    }
+
+def saturation_point(levels, min_gain=0.10):
+    """The lowest concurrency after which more concurrency adds less than min_gain throughput"""
+    for previous, level in zip(levels, levels[1:]):
+        if level["throughput"] < previous["throughput"] * (1 + min_gain):
+            return previous["concurrency"]
+    return None
+
+async def run(args):
+    links, fixtures = generate_posts(args.posts, args.seed)
+    server = ReplayServer(fixtures)
+    install_replay_adapter(server.netloc)
+
+    # The bot modules set everything up at import, so the environment has to be in place first
+    work_dir = tempfile.mkdtemp(prefix="load-")
+    os.environ.update(benchmark_env("direct", os.path.join(work_dir, "downloads")))
+    os.environ.update({"MONGO_URI": "", "DB_ROLLUP_INTERVAL": "0", "DOWNLOAD_WORKERS": str(args.workers)})
+    if args.rate_limits:
+        os.environ["RATE_LIMIT_ENABLED"] = "true"
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(work_dir)
+    bot_module = importlib.import_module("telethon_bot" if args.bot == "telethon" else "bot")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    transport = FakeTransport(args.upload_mbps * 1024 * 1024 / 8)
+    if args.bot == "telethon":
+        bot_module.bot = FakeTelethonClient(transport)
+
+    rng = random.Random(args.seed)
+    chat_ids = itertools.count(10 ** 9)
+    levels = []
+    try:
+        for concurrency in args.levels:
+            print(f"Running {args.updates} updates at concurrency {concurrency}...", file=sys.stderr)
+            levels.append(await run_level(bot_module, args.bot, transport, links, concurrency, args.updates, args.repeat_rate, rng, chat_ids))
+    finally:
+        await bot_module.download_pool.shutdown()
+        bot_module.downloader.close()
+        bot_module.db.close()
+        server.close()
+
+    return {
+        "benchmark": "load",
+        "created": datetime.utcnow().isoformat() + "Z",
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "bot": args.bot,
+        "workers": args.workers,
+        "posts": args.posts,
+        "repeat_rate": args.repeat_rate,
+        "upload_mbps": args.upload_mbps,
+        "levels": levels,
+        "saturation_concurrency": saturation_point(levels)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a bot's download handler with a fake Telegram and Instagram")
+    parser.add_argument("--bot", choices=["telethon", "pyrogram"], default="telethon")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64", help="Comma separated concurrency levels to step through")
+    parser.add_argument("--updates", type=int, default=100, help="Updates sent per concurrency level")
+    parser.add_argument("--posts", type=int, default=200, help="Distinct generated posts")
+    parser.add_argument("--repeat-rate", type=float, default=0.3, help="Share of updates repeating a recent link")
+    parser.add_argument("--workers", type=int, default=4, help="Download workers of the bot process")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="Simulated Telegram upload bandwidth (0 = unlimited)")
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the Instagram rate limiter on")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
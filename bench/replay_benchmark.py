@@ -0,0 +1,351 @@
+"""
+Offline benchmark of the download strategies.
+
+Recorded Instagram pages, API responses and media are replayed by a local
+stand-in HTTP server, so strategies run against identical inputs with no
+network. The server runs in this process and every strategy in its own
+subprocess, so the CPU time and peak RSS measured there are the strategy's
+own. Results are written as JSON for comparing releases.
+
+    python bench/replay_benchmark.py --iterations 20 --output results.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_FIXTURES = os.path.join(BENCH_DIR, "fixtures", "sample")
+
+STRATEGIES = ["browser", "ytdlp", "instaloader", "web_api", "direct"]
+
+# Strategies whose traffic can't be redirected to the replay server. Both have their own
+# HTTP stack and only take a proxy, and an HTTPS proxy gets CONNECT tunnels that the
+# replay server can't answer without intercepting TLS for Instagram's hosts.
+UNSUPPORTED = {
+    "browser": "Chrome only takes a proxy, which tunnels HTTPS past the replay server",
+    "ytdlp": "yt-dlp only takes a proxy, which tunnels HTTPS past the replay server"
+}
+
+# Control path a worker posts to once its warm-up is done, so only measured requests are counted
+RESET_PATH = "/__replay__/reset"
+
+def load_fixtures(fixtures_dir):
+    """Load a fixture set: the Instagram URLs to download and the responses to replay"""
+    with open(os.path.join(fixtures_dir, "fixtures.json"), 'r') as f:
+        fixtures = json.load(f)
+    fixtures["dir"] = os.path.abspath(fixtures_dir)
+    return fixtures
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class ReplayServer:
+    """
+    Local stand-in for Instagram's hosts. Requests carry their original host
+    in an X-Replay-Host header and are answered from the fixture routes;
+    anything without a route gets a 404 and is listed as unmatched.
+    """
+    def __init__(self, fixtures):
+        self.fixtures_dir = fixtures["dir"]
+        self.routes = {}
+        for route in fixtures["routes"]:
+            self.routes.setdefault((route.get("host", "*"), route["path"]), []).append(route)
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle(self, send_body=True)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                server.handle(self, send_body=True)
+
+            def do_HEAD(self):
+                server.handle(self, send_body=False)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.netloc = f"127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="replay-server", daemon=True)
+        self._thread.start()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.unmatched = set()
+
+    def _lookup(self, host, target):
+        path, _, query = target.partition('?')
+        params = parse_qs(query)
+        for key in ((host, target), (host, path), ("*", target), ("*", path)):
+            for route in self.routes.get(key, ()):
+                if all(params.get(name) == [value] for name, value in route.get("params", {}).items()):
+                    return route
+        return None
+
+    def _body(self, route):
+        """Get a route's response body: a recorded file, literal text, or generated bytes of a given size"""
+        key = id(route)
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is None:
+            if "file" in route:
+                with open(os.path.join(self.fixtures_dir, route["file"]), 'rb') as f:
+                    body = f.read()
+            elif "size" in route:
+                pattern = route["path"].encode() + b"\0"
+                body = (pattern * (route["size"] // len(pattern) + 1))[:route["size"]]
+            else:
+                body = route.get("text", "").encode()
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def handle(self, request, send_body):
+        if request.path == RESET_PATH:
+            self.reset_counters()
+            request.send_response(204)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        host = request.headers.get('X-Replay-Host', '')
+        route = self._lookup(host, request.path)
+        if route is None:
+            status, body, content_type = 404, b"", "text/plain"
+            with self._lock:
+                self.unmatched.add(f"{host}{request.path}")
+        else:
+            status, body, content_type = route.get("status", 200), self._body(route), route.get("content_type", "application/octet-stream")
+
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        if send_body:
+            request.wfile.write(body)
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body) if send_body else 0
+
+    def counters(self, attempts):
+        """Get the requests served, bytes sent and unmatched requests since the last reset"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes_transferred": self.bytes_sent,
+                "bytes_per_attempt": self.bytes_sent / attempts if attempts else 0,
+                "unmatched_requests": sorted(self.unmatched)[:20]
+            }
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def install_replay_adapter(netloc):
+    """Send every request made through requests (the HTTP client, instaloader) to the replay server"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class ReplayAdapter(HTTPAdapter):
+        """Rewrites request URLs to the replay server, keeping the original host in a header"""
+        def send(self, request, **kwargs):
+            parsed = urlsplit(request.url)
+            request.headers['X-Replay-Host'] = parsed.hostname or ''
+            request.url = urlunsplit(('http', netloc, parsed.path or '/', parsed.query, ''))
+            return super().send(request, **kwargs)
+
+    adapter = ReplayAdapter(pool_connections=8, pool_maxsize=32)
+    requests.Session.get_adapter = lambda session, url: adapter
+
+def run_worker(strategy, fixtures_dir, iterations, warmup, netloc):
+    """
+    Benchmark one strategy in this process against the replay server at netloc.
+    Returns its measurements; the traffic counters are added by the parent, which runs the server.
+    """
+    fixtures = load_fixtures(fixtures_dir)
+    install_replay_adapter(netloc)
+
+    sys.path.insert(0, REPO_DIR)
+    from downloader import InstagramDownloader, has_media
+    from strategy_stats import get_url_type
+
+    downloader = InstagramDownloader()
+
+    def attempt(url):
+        files = downloader._run_strategy(strategy, url, get_url_type(url))
+        success = has_media(files)
+        downloader.cleanup(files)
+        return success
+
+    try:
+        for _ in range(warmup):
+            for url in fixtures["cases"]:
+                attempt(url)
+        urllib.request.urlopen(urllib.request.Request(f"http://{netloc}{RESET_PATH}", method="POST"), timeout=10).close()
+
+        latencies = []
+        successes = 0
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        for _ in range(iterations):
+            for url in fixtures["cases"]:
+                start = time.perf_counter()
+                if attempt(url):
+                    successes += 1
+                latencies.append(time.perf_counter() - start)
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        downloader.close()
+
+    attempts = len(latencies)
+    return {
+        "supported": True,
+        "attempts": attempts,
+        "successes": successes,
+        "success_rate": successes / attempts if attempts else 0.0,
+        "latency": {
+            "mean": sum(latencies) / attempts if attempts else None,
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None
+        },
+        "cpu_seconds": (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": usage_after.ru_maxrss * 1024
+    }
+
+def benchmark_env(strategy, download_path):
+    """Environment for a worker: only this strategy, no accounts, no cache, rate limits or debug dumps"""
+    env = dict(os.environ)
+    env.update({
+        "DOWNLOAD_STRATEGIES": strategy,
+        "DOWNLOAD_PATH": download_path,
+        "INSTAGRAM_USERNAME": "",
+        "INSTAGRAM_PASSWORD": "",
+        "INSTAGRAM_ACCOUNTS": "",
+        "MEDIA_CACHE_ENABLED": "false",
+        "RATE_LIMIT_ENABLED": "false",
+        "STRATEGY_HEDGING": "false",
+        "DEBUG_ARTIFACTS": "off",
+        "DISK_TMPFS_PATH": "",
+        "SESSION_REFRESH_INTERVAL": "0"
+    })
+    return env
+
+def run_strategy(strategy, fixtures, args):
+    """Run one strategy's benchmark in a fresh subprocess, serving its requests from this process"""
+    if strategy in UNSUPPORTED:
+        return {"supported": False, "reason": UNSUPPORTED[strategy]}
+    covered = fixtures.get("strategies")
+    if covered is not None and strategy not in covered:
+        return {"supported": False, "reason": "the fixture set has no recorded responses for it"}
+
+    server = ReplayServer(fixtures)
+    download_path = tempfile.mkdtemp(prefix=f"bench-{strategy}-")
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--worker", strategy,
+        "--replay", server.netloc,
+        "--fixtures", args.fixtures,
+        "--iterations", str(args.iterations),
+        "--warmup", str(args.warmup)
+    ]
+    try:
+        result = subprocess.run(command, cwd=REPO_DIR, env=benchmark_env(strategy, download_path),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        return {"supported": True, "error": f"timed out after {args.timeout}s"}
+    finally:
+        server.close()
+        shutil.rmtree(download_path, ignore_errors=True)
+
+    lines = result.stdout.decode(errors='replace').strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"supported": True, "error": result.stderr.decode(errors='replace').strip().splitlines()[-5:]}
+    measurements = json.loads(lines[-1])
+    measurements.update(server.counters(measurements["attempts"]))
+    return measurements
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Instagram responses through each download strategy")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Fixture set directory (with fixtures.json)")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="Comma separated strategies to benchmark")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed passes over the fixture cases")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed passes before measuring")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds before a strategy's run is abandoned")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--replay", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.fixtures = os.path.abspath(args.fixtures)
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        measurements = run_worker(args.worker, args.fixtures, args.iterations, args.warmup, args.replay)
+        # On a line of its own: instaloader prints its progress to stdout without always ending the line
+        print("\n" + json.dumps(measurements))
+        return
+
+    fixtures = load_fixtures(args.fixtures)
+    results = {
+        "benchmark": "replay",
+        "created": datetime.utcnow().isoformat() + "Z",
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fixtures": os.path.basename(args.fixtures),
+        "cases": len(fixtures["cases"]),
+        "iterations": args.iterations,
+        "strategies": {}
+    }
+    for strategy in [name.strip() for name in args.strategies.split(",") if name.strip()]:
+        print(f"Benchmarking {strategy}...", file=sys.stderr)
+        results["strategies"][strategy] = run_strategy(strategy, fixtures, args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
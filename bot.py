@@ -4,11 +4,13 @@ import logging
 import asyncio
 import time
 from pyrogram import Client, filters, idle
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo
+from pyrogram.errors import RPCError
 import config
-from database import Database
-from downloader import InstagramDownloader
-import shutil
+from database import AsyncDatabase
+from downloader import InstagramDownloader, extract_shortcode
+from media_stream import RemoteMedia
+from worker_pool import DownloadPool
 
 # Configure logging
 logging.basicConfig(
@@ -18,11 +20,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize the database
-db = Database()
+db = AsyncDatabase()
 
 # Initialize the downloader
 downloader = InstagramDownloader()
 
+# Initialize the download worker pool (keeps blocking downloads off the event loop)
+download_pool = DownloadPool(downloader)
+
+# Strategy outcomes go to the database's event log for the analytics rollups
+downloader.strategy_stats.add_listener(db.log_strategy_outcome)
+
 # Initialize the Telegram bot - SIMPLIFIED
 bot = Client(
     "instagram_downloader_bot",
@@ -33,6 +41,183 @@ bot = Client(
     parse_mode=None  # Don't use any parse mode by default
 )
 
+# Captions for each kind of media we send
+MEDIA_CAPTIONS = {
+    "photo": "Instagram Photo",
+    "video": "Instagram Video",
+    "document": "Instagram Media"
+}
+
+# Telegram albums hold at most this many photos/videos
+ALBUM_SIZE = 10
+
+def album_media_type(file_path):
+    """Get whether a file can go into an album as a photo or a video (None if it can't)"""
+    if file_path.endswith(('.jpg', '.jpeg', '.png')):
+        return "photo"
+    if file_path.endswith(('.mp4', '.mov')):
+        return "video"
+    return None
+
+def sent_media_type(file_path):
+    """Get the media type a file is sent (and its reference stored) as"""
+    if file_path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+        return "photo"
+    if file_path.endswith(('.mp4', '.mov', '.avi')):
+        return "video"
+    return "document"
+
+def matches_sent_refs(files, refs):
+    """
+    Check whether a fresh download lines up with the references of the items already sent:
+    the same number of items, and the same media type (and size, for files on disk) at each of
+    their positions. If not, the post changed or came back differently and positions can't be trusted.
+    """
+    for ref in refs:
+        if ref["total"] != len(files):
+            return False
+        file_path = files[ref["index"]]
+        if sent_media_type(file_path) != ref["media_type"]:
+            return False
+        if ref.get("size") and os.path.isfile(file_path) and os.path.getsize(file_path) != ref["size"]:
+            return False
+    return True
+
+def chunks(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def input_media(media_type, media, caption=""):
+    """Build an album item for a photo or video (a file path or file_id)"""
+    if media_type == "photo":
+        return InputMediaPhoto(media, caption=caption)
+    return InputMediaVideo(media, caption=caption)
+
+def save_file_ref(shortcode, index, total, media_type, sent_message, file_size):
+    """Remember the file_id of a sent message so the media can be re-sent without uploading again"""
+    media = getattr(sent_message, media_type, None)
+    if media is None:
+        return
+    db.save_file_ref(shortcode, index, total, "pyrogram", media_type, media.file_id, file_size)
+
+async def send_file_refs(message, shortcode, url):
+    """
+    Re-send a post from stored Telegram file_ids.
+    Returns whether the whole post was sent and the references of the items that were, so that
+    after missing or stale file_ids only the rest has to be downloaded and sent.
+    """
+    refs = await db.get_file_refs(shortcode, "pyrogram")
+    delivered = []
+    if not refs:
+        return False, delivered
+    
+    senders = {
+        "photo": message.reply_photo,
+        "video": message.reply_video,
+        "document": message.reply_document
+    }
+    
+    try:
+        # Carousels of photos/videos go out as albums, like the first time they were sent
+        if len(refs) > 1 and all(ref["media_type"] in ("photo", "video") for ref in refs):
+            for group in chunks(refs, ALBUM_SIZE):
+                await message.reply_media_group([
+                    input_media(ref["media_type"], ref["ref"], f"{MEDIA_CAPTIONS[ref['media_type']]}\n{url}" if i == 0 else "")
+                    for i, ref in enumerate(group)
+                ])
+                for ref in group:
+                    delivered.append(ref)
+                    db.log_download(message.from_user.id, url, ref["_id"], ref.get("size", 0))
+            return True, delivered
+        
+        for ref in refs:
+            await senders[ref["media_type"]](
+                ref["ref"],
+                caption=f"{MEDIA_CAPTIONS[ref['media_type']]}\n{url}"
+            )
+            delivered.append(ref)
+            db.log_download(message.from_user.id, url, ref["_id"], ref.get("size", 0))
+    except (RPCError, ValueError) as e:
+        # Expired or invalid file_ids fall back to a normal download and upload of the items not sent yet
+        logger.warning(f"Stored file references for {shortcode} are no longer valid: {e}")
+        sent = {ref["index"] for ref in delivered}
+        db.delete_file_refs(shortcode, "pyrogram", [ref["index"] for ref in refs if ref["index"] not in sent])
+        return False, delivered
+    
+    return True, delivered
+
+def upload_progress(processing_msg, file_name, interval=3):
+    """Get a Pyrogram progress callback that shows upload progress in the processing message every few seconds"""
+    last_update = [0.0]
+    
+    async def progress(sent, total):
+        now = time.monotonic()
+        if now - last_update[0] < interval or sent >= total:
+            return
+        last_update[0] = now
+        try:
+            await processing_msg.edit(f"Uploading {file_name}... {sent * 100 // total}% ({sent / (1024 * 1024):.1f} of {total / (1024 * 1024):.1f} MB)")
+        except Exception as e:
+            logger.debug(f"Could not update upload progress: {e}")
+    return progress
+
+def too_large_message(file_size):
+    """Tell the user a video is over the upload size limit"""
+    return f"Video file is too large ({file_size / (1024 * 1024):.2f} MB). Telegram has a {config.MAX_UPLOAD_SIZE // (1024 * 1024)}MB limit for bots."
+
+async def fetch_remote_media(file_path):
+    """
+    Get a local path for a file to send. CDN files are downloaded in a worker thread first
+    (once for all requests sharing them): Pyrogram reads file-like objects synchronously
+    on the event loop and seeks them for their size, so it can't upload from a stream.
+    """
+    if isinstance(file_path, RemoteMedia):
+        path = await asyncio.get_running_loop().run_in_executor(None, downloader.materialize, file_path)
+        if path is None:
+            raise IOError(f"Could not fetch {file_path.url}")
+        return path
+    return file_path
+
+async def send_album(message, url, files, indexes, shortcode, remember_refs):
+    """
+    Send photos/videos as one album (Pyrogram uploads the items itself).
+    Returns the indexes (into files) of the items that were delivered.
+    """
+    album = []
+    sizes = {}
+    fetched = await asyncio.gather(*[fetch_remote_media(files[index]) for index in indexes], return_exceptions=True)
+    for index, file_path in zip(indexes, fetched):
+        if isinstance(file_path, Exception):
+            logger.error(f"Error fetching file {os.path.basename(files[index])}: {file_path}")
+            await message.reply(f"Error sending file: {os.path.basename(files[index])}")
+            continue
+        media_type = album_media_type(file_path)
+        file_size = sizes[index] = os.path.getsize(file_path)
+        if media_type == "video" and file_size > config.MAX_UPLOAD_SIZE:
+            await message.reply(too_large_message(file_size))
+            continue
+        album.append((index, media_type))
+    if not album:
+        return []
+    
+    first_type = album[0][1]
+    if len(album) == 1:
+        index, media_type = album[0]
+        sender = message.reply_photo if media_type == "photo" else message.reply_video
+        sent_messages = [await sender(files[index], caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}")]
+    else:
+        sent_messages = await message.reply_media_group([
+            input_media(media_type, files[index], f"{MEDIA_CAPTIONS[first_type]}\n{url}" if i == 0 else "")
+            for i, (index, media_type) in enumerate(album)
+        ])
+    logger.info(f"Sent album of {len(album)} files")
+    
+    for (index, media_type), sent_message in zip(album, sent_messages):
+        if remember_refs:
+            save_file_ref(shortcode, index, len(files), media_type, sent_message, sizes[index])
+        db.log_download(message.from_user.id, url, files[index], sizes[index])
+    return [index for index, _ in album]
+
 # Debug handler to log all incoming messages - must be registered first but will execute last
 @bot.on_message(group=-999)  # Very low priority group
 async def debug_all_messages(client, message):
@@ -43,6 +228,13 @@ async def debug_all_messages(client, message):
     except Exception as e:
         logger.error(f"Error in debug handler: {str(e)}")
 
+def format_stats(stats):
+    """Format a user's download statistics"""
+    text = f"Your Statistics\n\n- Total Downloads: {stats['downloads_count']}\n- Data Received: {stats['bytes_delivered'] / (1024 * 1024):.1f} MB"
+    if stats['last_download']:
+        text += f"\n- Last Download: {stats['last_download'].strftime('%Y-%m-%d %H:%M')} UTC"
+    return text
+
 # Command handlers
 @bot.on_message(filters.command("start"))
 async def start_command(client, message):
@@ -129,9 +321,9 @@ async def stats_command(client, message):
         user_id = message.from_user.id
         logger.info(f"Received /stats command from user: {user_id}")
         
-        stats = db.get_user_stats(user_id)
+        stats = await db.get_user_stats(user_id)
         
-        stats_text = f"Your Statistics\n\n- Total Downloads: {stats['downloads_count']}"
+        stats_text = format_stats(stats)
         
         await client.send_message(
             chat_id=user_id,
@@ -151,8 +343,8 @@ async def handle_callback_query(client, callback_query):
         logger.info(f"Received callback query with data '{data}' from user: {user_id}")
         
         if data == "stats":
-            stats = db.get_user_stats(user_id)
-            stats_text = f"Your Statistics\n\n- Total Downloads: {stats['downloads_count']}"
+            stats = await db.get_user_stats(user_id)
+            stats_text = format_stats(stats)
             await callback_query.answer()
             await callback_query.message.reply(stats_text)
         
@@ -204,73 +396,114 @@ async def download_media(client, message):
         url = url_match.group(1)
         logger.info(f"Extracted URL: {url}")
         
+        # Re-send previously uploaded media without downloading or uploading it again
+        shortcode = extract_shortcode(url)
+        delivered = []
+        if shortcode:
+            complete, delivered = await send_file_refs(message, shortcode, url)
+            if complete:
+                logger.info(f"Sent {shortcode} from stored file references to user: {user_id}")
+                return
+        
         # Send processing message
         processing_msg = await message.reply("Processing your Instagram link... Please wait.")
         
         # Download the media
         try:
             start_time = time.time()
-            files = downloader.download(url)
-            download_time = time.time() - start_time
-            
-            if not files:
-                await processing_msg.edit("Failed to download media. Possible reasons:\n- Private content\n- Invalid or expired link\n- Content no longer available")
-                logger.warning(f"Failed to download media from URL: {url}")
-                return
-            
-            logger.info(f"Successfully downloaded {len(files)} files from {url}")
-            
-            # Send success message
-            await processing_msg.edit(f"Download successful! ({len(files)} files)\nTime taken: {download_time:.2f} seconds\n\nUploading to Telegram...")
-            
-            # Send media files to user
-            for file_path in files:
-                try:
-                    file_size = os.path.getsize(file_path)
+            job = await download_pool.submit(url, stream=config.STREAM_UPLOADS)
+            try:
+                files = await job
+                download_time = time.time() - start_time
+                
+                if not files:
+                    await processing_msg.edit("Failed to download media. Possible reasons:\n- Private content\n- Invalid or expired link\n- Content no longer available")
+                    logger.warning(f"Failed to download media from URL: {url}")
+                    return
+                
+                logger.info(f"Successfully downloaded {len(files)} files from {url}")
+                
+                # Send success message
+                await processing_msg.edit(f"Download successful! ({len(files)} files)\nTime taken: {download_time:.2f} seconds\n\nUploading to Telegram...")
+                
+                # Send media files to user (only complete media results are remembered for re-sending)
+                remember_refs = shortcode and not any(f.endswith('.txt') for f in files)
+                
+                # Photos and videos of a carousel go out as albums, everything else one by one
+                # (items already re-sent from stored file_ids are skipped)
+                handled = set()
+                if delivered:
+                    if matches_sent_refs(files, delivered):
+                        handled = {ref["index"] for ref in delivered}
+                    else:
+                        # Everything goes out again and its references are stored anew
+                        logger.info(f"Download of {shortcode} doesn't line up with the items already sent, sending all of it")
+                        db.delete_file_refs(shortcode, "pyrogram")
+                album_indexes = [index for index, file_path in enumerate(files) if album_media_type(file_path) and index not in handled]
+                if len(album_indexes) > 1:
+                    for chunk in chunks(album_indexes, ALBUM_SIZE):
+                        try:
+                            await send_album(message, url, files, chunk, shortcode, remember_refs)
+                        except Exception as e:
+                            logger.error(f"Error sending album to user: {e}")
+                            await message.reply("Error sending album")
+                        handled.update(chunk)
+                
+                for index, file_path in enumerate(files):
+                    if index in handled:
+                        continue
                     file_name = os.path.basename(file_path)
-                    logger.info(f"Sending file: {file_name} ({file_size} bytes)")
-                    
-                    # Check file extension
-                    if file_path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                        await message.reply_photo(
-                            file_path,
-                            caption=f"Instagram Photo\n{url}"
-                        )
-                    elif file_path.endswith(('.mp4', '.mov', '.avi')):
-                        if file_size > 50 * 1024 * 1024:  # If file size > 50MB
-                            await message.reply(f"Video file is too large ({file_size / (1024 * 1024):.2f} MB). Telegram has a 50MB limit for bots.")
+                    try:
+                        # CDN files are fetched only now, after the download job has freed its worker
+                        file_path = await fetch_remote_media(file_path)
+                        file_size = os.path.getsize(file_path)
+                        logger.info(f"Sending file: {file_name} ({file_size} bytes)")
+                        
+                        # Check file extension
+                        sent_message = None
+                        if file_path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                            media_type = "photo"
+                            sent_message = await message.reply_photo(
+                                file_path,
+                                caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}"
+                            )
+                        elif file_path.endswith(('.mp4', '.mov', '.avi')):
+                            media_type = "video"
+                            if file_size > config.MAX_UPLOAD_SIZE:
+                                await message.reply(too_large_message(file_size))
+                            else:
+                                # Pyrogram uploads big files over several connections in parallel itself
+                                sent_message = await message.reply_video(
+                                    file_path,
+                                    caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}",
+                                    supports_streaming=True,
+                                    progress=upload_progress(processing_msg, os.path.basename(file_path))
+                                )
                         else:
-                            await message.reply_video(
+                            media_type = "document"
+                            sent_message = await message.reply_document(
                                 file_path,
-                                caption=f"Instagram Video\n{url}"
+                                caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}"
                             )
-                    else:
-                        await message.reply_document(
-                            file_path,
-                            caption=f"Instagram Media\n{url}"
-                        )
-                    
-                    logger.info(f"Successfully sent file: {file_name}")
+                        
+                        logger.info(f"Successfully sent file: {file_name}")
+                        
+                        if remember_refs and sent_message is not None:
+                            save_file_ref(shortcode, index, len(files), media_type, sent_message, file_size)
+                        
+                        # Log successful download
+                        db.log_download(user_id, url, file_path, file_size if sent_message is not None else 0)
                     
-                    # Log successful download
-                    db.log_download(user_id, url, file_path)
+                    except Exception as e:
+                        logger.error(f"Error sending file to user: {e}")
+                        await message.reply(f"Error sending file: {file_name}")
                 
-                except Exception as e:
-                    logger.error(f"Error sending file to user: {e}")
-                    await message.reply(f"Error sending file: {file_name}")
-            
-            # Final success message
-            await processing_msg.edit(f"All files sent successfully!\nTime taken: {time.time() - start_time:.2f} seconds")
-            
-            # Clean up downloaded files
-            for file_path in files:
+                # Final success message
+                await processing_msg.edit(f"All files sent successfully!\nTime taken: {time.time() - start_time:.2f} seconds")
+            finally:
+                # Clean up temporary download directories once every user sharing this download is done (cached media is kept)
                 try:
-                    if os.path.exists(file_path):
-                        # Delete the parent directory containing the downloaded files
-                        parent_dir = os.path.dirname(file_path)
-                        shutil.rmtree(parent_dir, ignore_errors=True)
-                        logger.info(f"Cleaned up download directory: {parent_dir}")
-                        break  # We only need to delete the parent directory once
+                    download_pool.release(job)
                 except Exception as e:
                     logger.error(f"Error cleaning up files: {e}")
         
@@ -317,6 +550,8 @@ async def main():
         
         # Cleanup on exit
         await bot.stop()
+        await download_pool.shutdown()
+        downloader.close()
         db.close()
         logging.info("Bot has been stopped")
     except Exception as e:
@@ -0,0 +1,138 @@
+import json
+import logging
+import time
+from urllib.parse import parse_qsl, urlsplit
+from media_manifest import find_post_media
+from page_extractor import PageExtractor
+from hedging import attempt_cancelled
+
+class NetworkCapture:
+    """
+    Watches a Chrome driver's DevTools network events while a post loads.
+    The page document and Instagram API/GraphQL JSON responses are decoded as
+    soon as they finish loading, so the media manifest is known without
+    waiting for the page to render, whether it is embedded in the HTML or
+    fetched by the page's scripts.
+
+    Media the page loads from the CDN is recorded as well. CDN URLs don't
+    name their post, so those are only a fallback for when no manifest shows
+    up, like scraping the rendered page but including videos whose element
+    only has a blob: URL.
+    """
+    API_URL_MARKERS = ('/api/v1/media/', '/graphql/query', '/api/graphql', '/graphql')
+    CDN_HOST_MARKERS = ('cdninstagram.com', 'fbcdn.net')
+    # Profile pictures are served from the t51.2885-19 family, post media from others
+    PROFILE_PICTURE_MARKER = '/t51.2885-19/'
+
+    def __init__(self, driver, shortcode):
+        self.driver = driver
+        self.shortcode = shortcode
+        self.media_urls = None
+        self.cdn_media_urls = []
+        self._pending = {}  # request id -> "document" or "api"
+
+    def reset(self):
+        """Discard network events left over from earlier page loads"""
+        try:
+            self.driver.get_log('performance')
+        except Exception as e:
+            logging.warning(f"Could not read browser performance log: {e}")
+
+    def _is_api_url(self, url):
+        return 'instagram.com' in url and any(marker in url for marker in self.API_URL_MARKERS)
+
+    def _record_cdn_media(self, url, mime_type):
+        """Remember an image or video the page fetched from the CDN"""
+        parsed = urlsplit(url)
+        if not any((parsed.hostname or '').endswith(marker) for marker in self.CDN_HOST_MARKERS):
+            return
+        if not mime_type.startswith(('image/', 'video/')) or self.PROFILE_PICTURE_MARKER in url:
+            return
+        # Byte ranges are DASH segments of separate video and audio tracks, not a playable file
+        if mime_type.startswith('video/') and any(name in ('bytestart', 'byteend') for name, _ in parse_qsl(parsed.query)):
+            return
+        if url not in self.cdn_media_urls:
+            self.cdn_media_urls.append(url)
+
+    def _read_body(self, request_id):
+        """Fetch a finished response body through the DevTools protocol. Returns None if it can't be read."""
+        try:
+            body = self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+        except Exception as e:
+            logging.debug(f"Could not read response body for request {request_id}: {e}")
+            return None
+        return body.get('body', '')
+
+    def _scan_document(self, text):
+        """Look for the post's media embedded in the page HTML, with the same extractor as direct page requests"""
+        extractor = PageExtractor(self.shortcode)
+        extractor.feed(text, final=True)
+        if extractor.complete:
+            self.media_urls = extractor.manifest().urls()
+            logging.info(f"Captured media manifest with {len(self.media_urls)} URLs from the page document")
+
+    def _scan_api_response(self, text):
+        """Look for the post in an API/GraphQL JSON response"""
+        # Some GraphQL endpoints prefix their JSON with an anti-hijacking guard
+        if text.startswith('for (;;);'):
+            text = text[len('for (;;);'):]
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+
+        media_urls = find_post_media(data, self.shortcode)
+        if media_urls:
+            self.media_urls = media_urls
+            logging.info(f"Captured media manifest with {len(media_urls)} URLs from network traffic")
+
+    def poll(self):
+        """Process the DevTools events received since the last poll"""
+        for entry in self.driver.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+
+            method = message.get('method')
+            params = message.get('params', {})
+
+            if method == 'Network.responseReceived':
+                response = params.get('response', {})
+                url = response.get('url', '')
+                mime_type = response.get('mimeType', '')
+                if params.get('type') == 'Document' and 'instagram.com' in url:
+                    self._pending[params.get('requestId')] = "document"
+                elif self._is_api_url(url) and ('json' in mime_type or 'javascript' in mime_type):
+                    self._pending[params.get('requestId')] = "api"
+                else:
+                    self._record_cdn_media(url, mime_type)
+
+            elif method == 'Network.loadingFinished':
+                kind = self._pending.pop(params.get('requestId'), None)
+                if kind and self.media_urls is None:
+                    text = self._read_body(params.get('requestId'))
+                    if text is not None:
+                        if kind == "document":
+                            self._scan_document(text)
+                        else:
+                            self._scan_api_response(text)
+
+            if self.media_urls is not None:
+                break
+
+    def wait_for_manifest(self, timeout, poll_interval=0.1):
+        """
+        Poll network events until the post's media manifest has been seen.
+        Returns the manifest's URLs, or None if it didn't show up before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not attempt_cancelled():
+            self.poll()
+            if self.media_urls is not None:
+                return self.media_urls
+            time.sleep(poll_interval)
+
+        logging.warning(f"No media manifest seen in network traffic within {timeout}s")
+        return None
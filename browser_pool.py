@@ -0,0 +1,249 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from webdriver_manager.chrome import ChromeDriverManager
+import config
+
+class BrowserPool:
+    """
+    Pool of long-lived Chrome drivers that log in to Instagram once.
+    Each driver is bound to one account from the session manager for its
+    whole lifetime. Drivers are borrowed per request, health-checked on
+    every borrow and return, and recycled after a configurable number of uses.
+    """
+    def __init__(self, sessions, size=None, max_uses=None, borrow_timeout=None):
+        self.sessions = sessions
+        self.size = size or config.BROWSER_POOL_SIZE
+        self.max_uses = max_uses or config.BROWSER_MAX_USES
+        self.borrow_timeout = borrow_timeout or config.BROWSER_BORROW_TIMEOUT
+
+        self._idle = queue.Queue()
+        self._uses = {}
+        self._accounts = {}
+        self._created = 0
+        self._lock = threading.Lock()
+        self._driver_path = None
+
+        # Borrow-wait statistics
+        self.borrow_count = 0
+        self.borrow_wait_total = 0.0
+        self.borrow_wait_max = 0.0
+        self.last_borrow_wait = 0.0
+
+    def _get_driver_path(self):
+        """Resolve the chromedriver binary once instead of on every request"""
+        with self._lock:
+            if self._driver_path is None:
+                self._driver_path = ChromeDriverManager().install()
+            return self._driver_path
+
+    def _create_driver(self):
+        """Start a new Chrome instance and log it in to Instagram"""
+        # Set up Chrome options
+        chrome_options = Options()
+        # Don't use headless mode - Instagram often blocks headless browsers
+        # chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--window-size=1920,1080")
+        chrome_options.add_argument("--disable-notifications")
+        chrome_options.add_argument("--disable-popup-blocking")
+        # Use a common mobile user-agent that's less likely to be detected as a bot
+        chrome_options.add_argument("--user-agent=Mozilla/5.0 (iPhone; CPU iPhone OS 14_7_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.2 Mobile/15E148 Safari/604.1")
+
+        if config.BROWSER_CAPTURE_MODE == "network":
+            # Record DevTools network events and don't block on subresources once the DOM is ready
+            chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+            chrome_options.page_load_strategy = "eager"
+
+        driver = webdriver.Chrome(service=Service(self._get_driver_path()), options=chrome_options)
+        driver.set_page_load_timeout(60)  # Increased timeout for slower connections
+
+        if config.BROWSER_CAPTURE_MODE == "network":
+            driver.execute_cdp_cmd("Network.enable", {})
+
+        session = self.sessions.acquire()
+        if session:
+            self._login(driver, session)
+        with self._lock:
+            self._accounts[id(driver)] = session
+
+        logging.info("Started new pooled browser instance")
+        return driver
+
+    def _login(self, driver, session):
+        """Log the driver in to Instagram; cookies stay in the driver for its whole lifetime"""
+        try:
+            # Reuse the account's existing session if it has one
+            if session.is_authenticated():
+                driver.get("https://www.instagram.com/")
+                for name, value in session.cookie_dict().items():
+                    driver.add_cookie({'name': name, 'value': value, 'domain': '.instagram.com', 'path': '/'})
+                driver.refresh()
+                if driver.get_cookie("sessionid") and "/accounts/login" not in driver.current_url:
+                    logging.info(f"Pooled browser reused the Instagram session of {session.username}")
+                    return
+
+            driver.get("https://www.instagram.com/accounts/login/")
+
+            # Wait for the username field and enter credentials
+            WebDriverWait(driver, 15).until(
+                EC.presence_of_element_located((By.NAME, "username"))
+            )
+
+            username_field = driver.find_element(By.NAME, "username")
+            password_field = driver.find_element(By.NAME, "password")
+
+            # Clear fields first
+            username_field.clear()
+            password_field.clear()
+
+            # Type credentials slowly like a human
+            for char in session.username:
+                username_field.send_keys(char)
+                time.sleep(0.05)
+
+            for char in session.password:
+                password_field.send_keys(char)
+                time.sleep(0.05)
+
+            # Find and click the login button
+            login_button = driver.find_element(By.XPATH, "//button[@type='submit']")
+            login_button.click()
+
+            # Wait for the login form to go away
+            WebDriverWait(driver, 20).until(lambda d: "Login" not in d.title and "/accounts/login" not in d.current_url)
+
+            logging.info("Successfully logged in to Instagram with pooled browser")
+
+            # Share the new cookies with the other strategies
+            session.set_cookies({cookie['name']: cookie['value'] for cookie in driver.get_cookies()})
+        except Exception as e:
+            logging.error(f"Error during browser login: {e}")
+
+    def _is_healthy(self, driver):
+        """Check that the browser still responds and (if we log in) still has a session"""
+        try:
+            if driver.execute_script("return 1") != 1:
+                return False
+            session = self._accounts.get(id(driver))
+            if session and not driver.get_cookie("sessionid"):
+                logging.warning(f"Pooled browser lost the Instagram session of {session.username}")
+                self.sessions.report(session, 401)
+                return False
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled browser failed health check: {e}")
+            return False
+
+    def _discard(self, driver):
+        """Quit a driver and free its slot in the pool"""
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._uses.pop(id(driver), None)
+            self._accounts.pop(id(driver), None)
+            self._created -= 1
+
+    def _acquire(self):
+        """Get a healthy driver, creating one if the pool isn't full yet"""
+        deadline = time.monotonic() + self.borrow_timeout
+        while True:
+            driver = None
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                create = False
+                with self._lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        create = True
+                if create:
+                    try:
+                        driver = self._create_driver()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    with self._lock:
+                        self._uses[id(driver)] = 0
+                    return driver
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No pooled browser became available within {self.borrow_timeout}s")
+                try:
+                    driver = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    raise TimeoutError(f"No pooled browser became available within {self.borrow_timeout}s")
+
+            if self._is_healthy(driver):
+                return driver
+            self._discard(driver)
+
+    def _release(self, driver):
+        """Return a driver to the pool or recycle it once it has been used enough"""
+        with self._lock:
+            self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+            uses = self._uses[id(driver)]
+
+        if uses >= self.max_uses:
+            logging.info(f"Recycling pooled browser after {uses} uses")
+            self._discard(driver)
+        elif not self._is_healthy(driver):
+            self._discard(driver)
+        else:
+            self._idle.put(driver)
+
+    @contextmanager
+    def borrow(self):
+        """Borrow a logged-in driver for the duration of a with-block"""
+        start_time = time.monotonic()
+        driver = self._acquire()
+        wait = time.monotonic() - start_time
+
+        with self._lock:
+            self.borrow_count += 1
+            self.borrow_wait_total += wait
+            self.borrow_wait_max = max(self.borrow_wait_max, wait)
+            self.last_borrow_wait = wait
+        logging.info(f"Borrowed pooled browser after waiting {wait:.2f} seconds")
+
+        try:
+            yield driver
+        finally:
+            self._release(driver)
+
+    def stats(self):
+        """Get pool size and borrow-wait statistics"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "borrows": self.borrow_count,
+                "avg_borrow_wait": self.borrow_wait_total / self.borrow_count if self.borrow_count else 0.0,
+                "max_borrow_wait": self.borrow_wait_max,
+                "last_borrow_wait": self.last_borrow_wait
+            }
+
+    def close(self):
+        """Quit all idle drivers"""
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+        logging.info("Browser pool closed")
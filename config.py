@@ -15,10 +15,106 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb+srv://abduhalilov245:fm2F8Gc51xPxmAT
 # Instagram credentials (optional, for private content)
 INSTAGRAM_USERNAME = os.getenv("INSTAGRAM_USERNAME", "")
 INSTAGRAM_PASSWORD = os.getenv("INSTAGRAM_PASSWORD", "")
+INSTAGRAM_ACCOUNTS = os.getenv("INSTAGRAM_ACCOUNTS", "")  # Extra accounts to rotate through, e.g. "user1:pass1,user2:pass2"
+
+# Instagram session manager settings
+SESSION_SELECTION = os.getenv("SESSION_SELECTION", "lru")  # "lru" or "round_robin"
+SESSION_COOLDOWN = float(os.getenv("SESSION_COOLDOWN", "600"))  # Seconds an account rests after HTTP 401/429
+SESSION_REFRESH_INTERVAL = float(os.getenv("SESSION_REFRESH_INTERVAL", "60"))  # Seconds between background re-login checks
 
 # Download settings
 DOWNLOAD_PATH = os.getenv("DOWNLOAD_PATH", "./downloads")
 
+# Download worker pool settings
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("DOWNLOAD_QUEUE_SIZE", "100"))
+
+# Download strategy settings (default order, adapted at runtime from observed results)
+DOWNLOAD_STRATEGIES = [name.strip() for name in os.getenv("DOWNLOAD_STRATEGIES", "browser,ytdlp,instaloader,web_api,direct").split(",") if name.strip()]
+STRATEGY_WINDOW = int(os.getenv("STRATEGY_WINDOW", "50"))  # Attempts remembered per strategy and link type
+STRATEGY_EXPLORATION_RATE = float(os.getenv("STRATEGY_EXPLORATION_RATE", "0.05"))
+
+# Hedged strategy execution: start the next strategy in parallel if the current one is slow
+STRATEGY_HEDGING = os.getenv("STRATEGY_HEDGING", "false").lower() == "true"
+STRATEGY_HEDGE_DELAY = float(os.getenv("STRATEGY_HEDGE_DELAY", "10"))  # Default seconds before hedging
+STRATEGY_HEDGE_DELAYS = os.getenv("STRATEGY_HEDGE_DELAYS", "")  # Per pair overrides, e.g. "browser>ytdlp=5,ytdlp>instaloader=3"
+STRATEGY_HEDGE_WORKERS = int(os.getenv("STRATEGY_HEDGE_WORKERS", str(DOWNLOAD_WORKERS * 3)))
+
+# Seconds between log lines with hedging, browser pool, rate limit, session, disk and cache statistics (0 disables)
+STATS_LOG_INTERVAL = float(os.getenv("STATS_LOG_INTERVAL", "300"))
+
+# Shared HTTP client settings
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))  # Keep-alive connections kept per host
+HTTP_PER_HOST_CONCURRENCY = int(os.getenv("HTTP_PER_HOST_CONCURRENCY", "4"))  # Parallel media fetches per CDN host
+HTTP_FETCH_WORKERS = int(os.getenv("HTTP_FETCH_WORKERS", "16"))
+HTTP_CHUNK_SIZE = int(os.getenv("HTTP_CHUNK_SIZE", str(1024 * 1024)))
+
+# Adaptive request rate limits (requests per second; lowered on HTTP 429/401, raised slowly on success)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_HOST_RATE = float(os.getenv("RATE_LIMIT_HOST_RATE", "2"))  # Per Instagram host/endpoint
+RATE_LIMIT_CDN_RATE = float(os.getenv("RATE_LIMIT_CDN_RATE", "20"))  # Shared by all media CDN hosts
+RATE_LIMIT_ACCOUNT_RATE = float(os.getenv("RATE_LIMIT_ACCOUNT_RATE", "0.5"))  # Per Instagram account
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_MAX_FACTOR = float(os.getenv("RATE_LIMIT_MAX_FACTOR", "4"))  # Highest rate as a multiple of the initial one
+RATE_LIMIT_MIN_RATE = float(os.getenv("RATE_LIMIT_MIN_RATE", "0.05"))
+RATE_LIMIT_INCREASE = float(os.getenv("RATE_LIMIT_INCREASE", "0.05"))  # Fraction of the initial rate added per success
+RATE_LIMIT_DECREASE = float(os.getenv("RATE_LIMIT_DECREASE", "0.5"))  # Rate multiplier on throttling
+
+# Browser pool settings
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "50"))
+BROWSER_BORROW_TIMEOUT = float(os.getenv("BROWSER_BORROW_TIMEOUT", "120"))
+BROWSER_CAPTURE_MODE = os.getenv("BROWSER_CAPTURE_MODE", "network")  # "network" (DevTools) or "dom" (fixed wait + page scraping)
+BROWSER_CAPTURE_TIMEOUT = float(os.getenv("BROWSER_CAPTURE_TIMEOUT", "15"))
+
+# Debug artifacts (browser page dumps and screenshots)
+DEBUG_ARTIFACTS = os.getenv("DEBUG_ARTIFACTS", "on-failure")  # "off", "on-failure", "sampled" or "always"
+DEBUG_ARTIFACTS_SAMPLE_RATE = float(os.getenv("DEBUG_ARTIFACTS_SAMPLE_RATE", "0.01"))  # Fraction of attempts captured when "sampled"
+DEBUG_ARTIFACTS_PATH = os.getenv("DEBUG_ARTIFACTS_PATH", "./debug_artifacts")
+DEBUG_ARTIFACTS_MAX_ENTRIES = int(os.getenv("DEBUG_ARTIFACTS_MAX_ENTRIES", "50"))  # Oldest captures are deleted beyond this
+
+# Media cache settings
+MEDIA_CACHE_ENABLED = os.getenv("MEDIA_CACHE_ENABLED", "true").lower() == "true"
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", "./media_cache")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+MEDIA_CACHE_MIN_AGE = float(os.getenv("MEDIA_CACHE_MIN_AGE", "300"))  # Seconds a just-served entry is protected from eviction
+
+# Stream CDN media straight into Telegram uploads instead of writing it to disk first
+# (takes effect only when the media cache is disabled, since cached posts live on disk; the
+# Pyrogram bot can't upload from a stream and fetches the files to disk when it sends them)
+STREAM_UPLOADS = os.getenv("STREAM_UPLOADS", "true").lower() == "true"
+
+# Upload size limit for videos, capped at the 2000 MB bots can upload over MTProto,
+# and how many parts of a big file the Telethon bot uploads at once
+MTPROTO_MAX_UPLOAD_SIZE = 4000 * 512 * 1024
+MAX_UPLOAD_SIZE = min(int(float(os.getenv("MAX_UPLOAD_SIZE_MB", "2000")) * 1024 * 1024), MTPROTO_MAX_UPLOAD_SIZE)
+UPLOAD_PARALLELISM = max(1, int(os.getenv("UPLOAD_PARALLELISM", "4")))
+
+# Database: threads for reads from the async handlers, and batching of download log writes
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+DB_LOG_BATCH_SIZE = int(os.getenv("DB_LOG_BATCH_SIZE", "100"))
+DB_LOG_FLUSH_INTERVAL = float(os.getenv("DB_LOG_FLUSH_INTERVAL", "2"))
+DB_LOG_QUEUE_SIZE = int(os.getenv("DB_LOG_QUEUE_SIZE", "10000"))
+# Seconds between writes of user activity (last_active); new or changed profiles are written right away
+DB_USER_FLUSH_INTERVAL = float(os.getenv("DB_USER_FLUSH_INTERVAL", "60"))
+
+# How long raw download/strategy events are kept, and how often the hourly/daily rollups are updated (seconds, 0 disables)
+DB_EVENTS_RETENTION_DAYS = float(os.getenv("DB_EVENTS_RETENTION_DAYS", "30"))
+DB_ROLLUP_INTERVAL = float(os.getenv("DB_ROLLUP_INTERVAL", "300"))
+
+# Scratch space under DOWNLOAD_PATH: byte quota (0 = unlimited) and how long new downloads wait for space,
+# how long a scratch directory nobody holds a lease on (e.g. left by a crash) may live before the reaper deletes it,
+# and how often the reaper runs (seconds).
+# DISK_TMPFS_PATH (e.g. /dev/shm/ig-downloader) puts scratch space of image posts on tmpfs, up to DISK_TMPFS_QUOTA_MB.
+# Every scratch directory counts as at least DISK_LEASE_RESERVE_MB against its quota until it holds more than that
+DISK_QUOTA = int(float(os.getenv("DISK_QUOTA_MB", "4096")) * 1024 * 1024)
+DISK_LEASE_RESERVE = int(float(os.getenv("DISK_LEASE_RESERVE_MB", "16")) * 1024 * 1024)
+DISK_QUOTA_WAIT = float(os.getenv("DISK_QUOTA_WAIT", "60"))
+DISK_LEASE_TTL = float(os.getenv("DISK_LEASE_TTL", "3600"))
+DISK_REAP_INTERVAL = float(os.getenv("DISK_REAP_INTERVAL", "60"))
+DISK_TMPFS_PATH = os.getenv("DISK_TMPFS_PATH", "")
+DISK_TMPFS_QUOTA = int(float(os.getenv("DISK_TMPFS_QUOTA_MB", "256")) * 1024 * 1024)
+
 # Create download directory if it doesn't exist
 if not os.path.exists(DOWNLOAD_PATH):
     os.makedirs(DOWNLOAD_PATH) 
\ No newline at end of file
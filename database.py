@@ -1,15 +1,58 @@
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne, ReplaceOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import queue
+import threading
+import time
 import config
 import logging
 
 class Database:
-    def __init__(self):
+    """
+    MongoDB storage of users, sent file references and the download log.
+    
+    Downloads and download strategy outcomes are logged as events in the
+    download_events time-series collection, which expires them after
+    DB_EVENTS_RETENTION_DAYS. A background job keeps hourly and daily
+    rollups of the events in download_rollups for analytics. The old
+    downloads collection is only read by the counter backfill.
+    """
+    def __init__(self, batch_size=None, flush_interval=None, queue_size=None, rollup_interval=None):
         self.client = None
         self.db = None
         self.users_collection = None
         self.downloads_collection = None
+        self.events_collection = None
+        self.rollups_collection = None
+        self.file_refs_collection = None
+        
+        # Log events are buffered and written in batches by a background thread
+        self.batch_size = batch_size or config.DB_LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or config.DB_LOG_FLUSH_INTERVAL
+        self.rollup_interval = rollup_interval if rollup_interval is not None else config.DB_ROLLUP_INTERVAL
+        self.dropped_logs = 0
+        self._log_queue = queue.Queue(maxsize=queue_size or config.DB_LOG_QUEUE_SIZE)
+        
+        # User profile/activity updates are coalesced in memory and written behind by the same thread
+        self.user_flush_interval = config.DB_USER_FLUSH_INTERVAL
+        self._known_users = {}
+        self._pending_users = {}
+        self._users_due = time.monotonic() + self.user_flush_interval
+        self._users_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._rollups = None
+        
         self._connect()
+        if self.events_collection is not None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="db-log-flush", daemon=True)
+            self._flusher.start()
+            if self.rollup_interval > 0:
+                self._rollups = threading.Thread(target=self._rollup_loop, name="db-rollups", daemon=True)
+                self._rollups.start()
     
     def _connect(self):
         """Connect to MongoDB Atlas database"""
@@ -22,6 +65,9 @@ class Database:
             self.db = self.client.instagram_downloader
             self.users_collection = self.db.users
             self.downloads_collection = self.db.downloads
+            self.events_collection = self.db.download_events
+            self.rollups_collection = self.db.download_rollups
+            self.file_refs_collection = self.db.file_refs
             logging.info("Successfully connected to MongoDB")
         except Exception as e:
             logging.error(f"Failed to connect to MongoDB: {e}")
@@ -30,58 +76,499 @@ class Database:
             self.db = None
             self.users_collection = None
             self.downloads_collection = None
+            self.events_collection = None
+            self.rollups_collection = None
+            self.file_refs_collection = None
+            return
+        
+        # Each setup step on its own, so one failing doesn't skip the others
+        try:
+            self._ensure_events_collection()
+        except Exception as e:
+            logging.error(f"Failed to set up the download_events collection: {e}")
+        self._ensure_indexes()
+    
+    def _ensure_events_collection(self):
+        """Create the time-series event log with its retention window, or update the window"""
+        retention = int(config.DB_EVENTS_RETENTION_DAYS * 86400)
+        existing = next(iter(self.db.list_collections(filter={"name": "download_events"})), None)
+        if existing is not None:
+            if existing.get("type") == "timeseries":
+                self.db.command("collMod", "download_events", expireAfterSeconds=retention)
+            else:
+                # A plain collection (server without time-series support) expires through its TTL index instead
+                self._ensure_ttl_index(retention)
+            return
+        
+        try:
+            self.db.create_collection(
+                "download_events",
+                timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "minutes"},
+                expireAfterSeconds=retention
+            )
+            logging.info("Created download_events time-series collection")
+        except Exception as e:
+            logging.warning(f"Could not create time-series collection, using a TTL indexed one: {e}")
+            self._ensure_ttl_index(retention)
+    
+    def _ensure_ttl_index(self, retention):
+        """Create the TTL index of a plain event collection, changing its expiry in place if it already exists"""
+        try:
+            self.events_collection.create_index("timestamp", expireAfterSeconds=retention, name="timestamp_ttl")
+        except OperationFailure as e:
+            # IndexOptionsConflict: the index exists with another expiry, which collMod can change without a rebuild
+            if e.code != 85:
+                raise
+            self.db.command("collMod", "download_events", index={"name": "timestamp_ttl", "expireAfterSeconds": retention})
+            logging.info(f"Changed download event retention to {retention} seconds")
+    
+    def _ensure_indexes(self):
+        """Create the indexes the queries rely on and check they exist"""
+        wanted = [
+            (self.downloads_collection, [
+                [("user_id", ASCENDING)],
+                [("timestamp", DESCENDING)]
+            ]),
+            (self.events_collection, [
+                [("meta.kind", ASCENDING), ("timestamp", DESCENDING)],
+                [("meta.user_id", ASCENDING), ("timestamp", DESCENDING)]
+            ]),
+            (self.rollups_collection, [
+                [("period", ASCENDING), ("start", DESCENDING)]
+            ]),
+            (self.users_collection, [
+                [("last_download", DESCENDING)]
+            ]),
+            (self.file_refs_collection, [
+                [("shortcode", ASCENDING), ("client", ASCENDING), ("index", ASCENDING)]
+            ])
+        ]
+        for collection, indexes in wanted:
+            names = []
+            for keys in indexes:
+                try:
+                    names.append(collection.create_index(keys))
+                except Exception as e:
+                    logging.error(f"Failed to create index {keys} on {collection.name}: {e}")
+            try:
+                existing = collection.index_information()
+            except Exception as e:
+                logging.error(f"Failed to list indexes of {collection.name}: {e}")
+                continue
+            missing = [name for name in names if name not in existing]
+            if missing:
+                logging.warning(f"Indexes missing on {collection.name}: {', '.join(missing)}")
+        logging.info("MongoDB indexes verified")
     
     def add_user(self, user_id, username, first_name):
-        """Add or update user in the database"""
+        """
+        Add or update user in the database. The write is deferred and coalesced:
+        new or changed profiles go out with the next log batch, activity of
+        known users with the periodic user flush.
+        """
         if self.users_collection is None:
             return
         
+        user_id = str(user_id)
+        with self._users_lock:
+            self._pending_users[user_id] = {
+                "username": username,
+                "first_name": first_name,
+                "last_active": datetime.utcnow()
+            }
+            if self._known_users.get(user_id) != (username, first_name):
+                self._users_due = 0.0
+    
+    def flush_users(self):
+        """Write the pending user profile and activity updates in one bulk_write"""
+        with self._users_lock:
+            pending, self._pending_users = self._pending_users, {}
+            self._users_due = time.monotonic() + self.user_flush_interval
+        if not pending:
+            return
+        
+        try:
+            self.users_collection.bulk_write([
+                UpdateOne({"_id": user_id}, {"$set": fields}, upsert=True)
+                for user_id, fields in pending.items()
+            ], ordered=False)
+            logging.info(f"Updated {len(pending)} users in database")
+        except Exception as e:
+            logging.error(f"Failed to add/update {len(pending)} users in database: {e}")
+            # Retry with the next flush unless newer updates came in meanwhile
+            with self._users_lock:
+                for user_id, fields in pending.items():
+                    self._pending_users.setdefault(user_id, fields)
+            return
+        
+        with self._users_lock:
+            for user_id, fields in pending.items():
+                self._known_users[user_id] = (fields["username"], fields["first_name"])
+    
+    def _queue_event(self, event):
+        """Queue a log event for the next batch, dropping it if the queue is full. Returns False if dropped."""
+        if self.events_collection is None:
+            return False
+        
+        try:
+            self._log_queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped_logs += 1
+            return False
+    
+    def log_download(self, user_id, instagram_url, file_path, file_size=0):
+        """Queue a successful download to be logged with the next batch (never blocks)"""
+        # Only the file name is kept, the download directory is deleted right after sending
+        queued = self._queue_event({
+            "timestamp": datetime.utcnow(),
+            "meta": {"kind": "download", "user_id": str(user_id)},
+            "instagram_url": instagram_url,
+            "file_name": os.path.basename(file_path),
+            "file_size": file_size
+        })
+        if not queued and self.events_collection is not None:
+            logging.warning(f"Download log queue is full, dropped log entry for user {user_id}: {instagram_url}")
+    
+    def log_strategy_outcome(self, url_type, strategy, success, latency):
+        """Queue the outcome of a download strategy attempt (a StrategyStats listener)"""
+        self._queue_event({
+            "timestamp": datetime.utcnow(),
+            "meta": {"kind": "strategy", "strategy": strategy, "url_type": url_type, "outcome": "success" if success else "failure"},
+            "latency": latency
+        })
+    
+    def _next_batch(self):
+        """Wait for a log entry, then collect more until the batch is full or the flush interval has passed"""
+        try:
+            batch = [self._log_queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._log_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._insert_events(batch)
+            if time.monotonic() >= self._users_due:
+                self.flush_users()
+    
+    def _insert_events(self, batch):
+        """Write a batch of log events in one round trip and add the downloads to the users' counters"""
+        try:
+            self.events_collection.insert_many(batch, ordered=False)
+            inserted = batch
+            logging.info(f"Logged {len(batch)} events in database")
+        except BulkWriteError as e:
+            # Unordered inserts keep going past errors; only the events that were written are counted
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            inserted = [event for index, event in enumerate(batch) if index not in failed]
+            logging.error(f"Failed to log {len(failed)} of {len(batch)} events in database: {e}")
+        except Exception as e:
+            logging.error(f"Failed to log {len(batch)} events in database: {e}")
+            return
+        
+        counters = {}
+        for event in inserted:
+            if event["meta"]["kind"] != "download":
+                continue
+            user_id = event["meta"]["user_id"]
+            count, size, last = counters.get(user_id, (0, 0, event["timestamp"]))
+            counters[user_id] = (count + 1, size + (event["file_size"] or 0), max(last, event["timestamp"]))
+        if not counters:
+            return
+        try:
+            self.users_collection.bulk_write([
+                UpdateOne(
+                    {"_id": user_id},
+                    {
+                        "$inc": {"downloads_count": count, "bytes_delivered": size},
+                        "$max": {"last_download": last}
+                    },
+                    upsert=True
+                )
+                for user_id, (count, size, last) in counters.items()
+            ], ordered=False)
+        except Exception as e:
+            logging.error(f"Failed to update download counters of {len(counters)} users: {e}")
+    
+    def flush(self):
+        """Write every queued log event now"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._log_queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._insert_events(batch)
+                batch = []
+        if batch:
+            self._insert_events(batch)
+    
+    def get_user_stats(self, user_id):
+        """Get statistics for a specific user from the counters kept on their user document"""
+        stats = {"downloads_count": 0, "bytes_delivered": 0, "last_download": None}
+        if self.users_collection is None:
+            return stats
+        
         try:
-            self.users_collection.update_one(
+            user = self.users_collection.find_one(
                 {"_id": str(user_id)},
+                {"downloads_count": 1, "bytes_delivered": 1, "last_download": 1}
+            )
+            if user:
+                stats.update({key: user[key] for key in stats if user.get(key) is not None})
+            return stats
+        except Exception as e:
+            logging.error(f"Failed to get user stats: {e}")
+            return stats
+    
+    def backfill_user_counters(self, batch_size=1000):
+        """
+        Recompute every user's download counters from the old downloads log and the event log.
+        Meant to be run once, with the bots stopped, since it overwrites the counters.
+        Returns the number of users updated.
+        """
+        if self.events_collection is None:
+            return 0
+        
+        def totals(collection, user_field, match):
+            return collection.aggregate([
+                {"$match": match},
+                {"$group": {
+                    "_id": user_field,
+                    "downloads_count": {"$sum": 1},
+                    "bytes_delivered": {"$sum": {"$ifNull": ["$file_size", 0]}},
+                    "last_download": {"$max": "$timestamp"}
+                }}
+            ], allowDiskUse=True)
+        
+        users = {}
+        for total in list(totals(self.downloads_collection, "$user_id", {})) + list(totals(self.events_collection, "$meta.user_id", {"meta.kind": "download"})):
+            user = users.setdefault(total["_id"], {"downloads_count": 0, "bytes_delivered": 0, "last_download": total["last_download"]})
+            user["downloads_count"] += total["downloads_count"]
+            user["bytes_delivered"] += total["bytes_delivered"]
+            user["last_download"] = max(user["last_download"], total["last_download"])
+        
+        updated = 0
+        updates = []
+        for user_id, counters in users.items():
+            updates.append(UpdateOne({"_id": user_id}, {"$set": counters}, upsert=True))
+            if len(updates) >= batch_size:
+                self.users_collection.bulk_write(updates, ordered=False)
+                updated += len(updates)
+                updates = []
+        if updates:
+            self.users_collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+        
+        logging.info(f"Backfilled download counters of {updated} users")
+        return updated
+    
+    def get_file_refs(self, shortcode, client_name):
+        """
+        Get the Telegram file references stored for every media item of a post.
+        Returns an empty list unless references for all items are available.
+        """
+        if self.file_refs_collection is None:
+            return []
+        
+        try:
+            refs = list(self.file_refs_collection.find(
+                {"shortcode": shortcode, "client": client_name}
+            ).sort("index", 1))
+            if not refs or len(refs) != refs[0]["total"]:
+                return []
+            return refs
+        except Exception as e:
+            logging.error(f"Failed to get file references: {e}")
+            return []
+    
+    def save_file_ref(self, shortcode, index, total, client_name, media_type, ref, file_size=0):
+        """Store the Telegram file reference and size of one uploaded media item"""
+        if self.file_refs_collection is None:
+            return
+        
+        try:
+            self.file_refs_collection.update_one(
+                {"_id": f"{client_name}:{shortcode}:{index}"},
                 {
                     "$set": {
-                        "username": username,
-                        "first_name": first_name,
-                        "last_active": datetime.utcnow()
+                        "shortcode": shortcode,
+                        "index": index,
+                        "total": total,
+                        "client": client_name,
+                        "media_type": media_type,
+                        "ref": ref,
+                        "size": file_size,
+                        "updated": datetime.utcnow()
                     }
                 },
                 upsert=True
             )
-            logging.info(f"User {user_id} added/updated in database")
         except Exception as e:
-            logging.error(f"Failed to add/update user in database: {e}")
+            logging.error(f"Failed to save file reference: {e}")
     
-    def log_download(self, user_id, instagram_url, file_path):
-        """Log a successful download in the database"""
-        if self.downloads_collection is None:
+    def delete_file_refs(self, shortcode, client_name, indexes=None):
+        """Forget the stored file references of a post, or only of some of its items (e.g. after they went stale)"""
+        if self.file_refs_collection is None:
             return
         
+        query = {"shortcode": shortcode, "client": client_name}
+        if indexes is not None:
+            query["index"] = {"$in": list(indexes)}
         try:
-            self.downloads_collection.insert_one({
-                "user_id": str(user_id),
-                "instagram_url": instagram_url,
-                "file_path": file_path,
-                "timestamp": datetime.utcnow()
-            })
-            logging.info(f"Download logged for user {user_id}: {instagram_url}")
+            self.file_refs_collection.delete_many(query)
+            logging.info(f"Deleted stale file references for {shortcode}")
         except Exception as e:
-            logging.error(f"Failed to log download in database: {e}")
+            logging.error(f"Failed to delete file references: {e}")
     
-    def get_user_stats(self, user_id):
-        """Get statistics for a specific user"""
-        if self.downloads_collection is None:
-            return {"downloads_count": 0}
+    def _rollup_loop(self):
+        while not self._stop.wait(self.rollup_interval):
+            try:
+                self.update_rollups()
+            except Exception as e:
+                logging.error(f"Failed to update download rollups: {e}")
+    
+    def update_rollups(self):
+        """
+        Recompute the hourly rollups of the last two hours (all hours on the first run)
+        and the daily rollups of the days they fall in, from the hourly ones
+        """
+        latest = self.rollups_collection.find_one({"period": "hour"}, sort=[("start", DESCENDING)])
+        since = latest["start"] - timedelta(hours=1) if latest else datetime.min
         
+        hours = {}
+        for group in self.events_collection.aggregate([
+            {"$match": {"timestamp": {"$gte": since}}},
+            {"$group": {
+                "_id": {
+                    "start": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+                    "kind": "$meta.kind",
+                    "strategy": "$meta.strategy",
+                    "outcome": "$meta.outcome"
+                },
+                "count": {"$sum": 1},
+                "bytes": {"$sum": {"$ifNull": ["$file_size", 0]}}
+            }}
+        ], allowDiskUse=True):
+            key = group["_id"]
+            rollup = hours.setdefault(key["start"], {"period": "hour", "start": key["start"], "downloads": 0, "bytes": 0, "strategies": {}})
+            if key["kind"] == "download":
+                rollup["downloads"] += group["count"]
+                rollup["bytes"] += group["bytes"]
+            elif key["kind"] == "strategy":
+                outcomes = rollup["strategies"].setdefault(key["strategy"], {"success": 0, "failure": 0})
+                outcomes[key["outcome"]] = outcomes.get(key["outcome"], 0) + group["count"]
+        if not hours:
+            return
+        
+        self.rollups_collection.bulk_write([
+            ReplaceOne({"_id": f"hour:{start.isoformat()}"}, rollup, upsert=True)
+            for start, rollup in hours.items()
+        ], ordered=False)
+        
+        days = {}
+        for start in hours:
+            day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+            if day in days:
+                continue
+            rollup = days[day] = {"period": "day", "start": day, "downloads": 0, "bytes": 0, "strategies": {}}
+            for hour in self.rollups_collection.find({"period": "hour", "start": {"$gte": day, "$lt": day + timedelta(days=1)}}):
+                rollup["downloads"] += hour["downloads"]
+                rollup["bytes"] += hour["bytes"]
+                for strategy, outcomes in hour["strategies"].items():
+                    totals = rollup["strategies"].setdefault(strategy, {"success": 0, "failure": 0})
+                    for outcome, count in outcomes.items():
+                        totals[outcome] = totals.get(outcome, 0) + count
+        
+        self.rollups_collection.bulk_write([
+            ReplaceOne({"_id": f"day:{day.date().isoformat()}"}, rollup, upsert=True)
+            for day, rollup in days.items()
+        ], ordered=False)
+        logging.info(f"Updated download rollups of {len(hours)} hours and {len(days)} days")
+    
+    def get_rollups(self, period="day", since=None):
+        """Get the hourly or daily rollups starting at or after since, oldest first"""
+        if self.rollups_collection is None:
+            return []
+        
+        query = {"period": period}
+        if since:
+            query["start"] = {"$gte": since}
         try:
-            downloads_count = self.downloads_collection.count_documents({"user_id": str(user_id)})
-            return {"downloads_count": downloads_count}
+            return list(self.rollups_collection.find(query).sort("start", ASCENDING))
         except Exception as e:
-            logging.error(f"Failed to get user stats: {e}")
-            return {"downloads_count": 0}
+            logging.error(f"Failed to get download rollups: {e}")
+            return []
     
     def close(self):
-        """Close MongoDB connection"""
+        """Flush queued log events and close MongoDB connection"""
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join(timeout=self.flush_interval + 10)
+        if self.events_collection is not None:
+            self.flush()
+            self.flush_users()
         if self.client:
             self.client.close()
-            logging.info("MongoDB connection closed") 
\ No newline at end of file
+            logging.info("MongoDB connection closed")
+
+class AsyncDatabase:
+    """
+    Non-blocking front end of Database for the bots' async handlers.
+    
+    Reads run in a thread pool and are awaited. Writes are queued in order on
+    a single background thread and return immediately, and download logs and
+    user updates are buffered by Database, so the database never sits on the
+    request path.
+    """
+    def __init__(self, database=None, workers=None):
+        self.database = database or Database()
+        self._readers = ThreadPoolExecutor(max_workers=workers or config.DB_WORKERS, thread_name_prefix="db-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+    
+    async def _read(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, method, *args)
+    
+    def _write(self, method, *args):
+        return self._writer.submit(method, *args)
+    
+    def add_user(self, user_id, username, first_name):
+        self.database.add_user(user_id, username, first_name)
+    
+    def log_download(self, user_id, instagram_url, file_path, file_size=0):
+        self.database.log_download(user_id, instagram_url, file_path, file_size)
+    
+    def log_strategy_outcome(self, url_type, strategy, success, latency):
+        self.database.log_strategy_outcome(url_type, strategy, success, latency)
+    
+    async def get_user_stats(self, user_id):
+        return await self._read(self.database.get_user_stats, user_id)
+    
+    async def get_file_refs(self, shortcode, client_name):
+        return await self._read(self.database.get_file_refs, shortcode, client_name)
+    
+    def save_file_ref(self, shortcode, index, total, client_name, media_type, ref, file_size=0):
+        return self._write(self.database.save_file_ref, shortcode, index, total, client_name, media_type, ref, file_size)
+    
+    def delete_file_refs(self, shortcode, client_name, indexes=None):
+        return self._write(self.database.delete_file_refs, shortcode, client_name, indexes)
+    
+    def close(self):
+        """Finish queued writes, flush buffered logs and user updates and close the connection"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=False)
+        self.database.close() 
\ No newline at end of file
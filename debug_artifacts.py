@@ -0,0 +1,65 @@
+import os
+import time
+import random
+import shutil
+import logging
+import threading
+import config
+
+class DebugArtifacts:
+    """
+    Decides when page dumps and screenshots are captured and keeps them in a
+    bounded debug store, outside the per-request download directories.
+
+    Policies: "off", "on-failure" (only when a download attempt failed),
+    "sampled" (a random fraction of attempts, plus failures) and "always".
+    The store keeps the newest max_entries captures and deletes older ones.
+    """
+    POLICIES = ("off", "on-failure", "sampled", "always")
+
+    def __init__(self, policy=None, sample_rate=None, path=None, max_entries=None):
+        self.policy = policy or config.DEBUG_ARTIFACTS
+        if self.policy not in self.POLICIES:
+            logging.warning(f"Unknown debug artifact policy {self.policy!r}, using 'off'")
+            self.policy = "off"
+        self.sample_rate = sample_rate if sample_rate is not None else config.DEBUG_ARTIFACTS_SAMPLE_RATE
+        self.path = path or config.DEBUG_ARTIFACTS_PATH
+        self.max_entries = max_entries or config.DEBUG_ARTIFACTS_MAX_ENTRIES
+        self._lock = threading.Lock()
+
+    def should_capture(self, failed):
+        """Check whether the policy wants artifacts for an attempt"""
+        if self.policy == "always":
+            return True
+        if self.policy == "on-failure":
+            return failed
+        if self.policy == "sampled":
+            return failed or random.random() < self.sample_rate
+        return False
+
+    def capture(self, driver, label, failed=False):
+        """Save the browser's page source and a screenshot if the policy asks for it. Returns the capture directory."""
+        if not self.should_capture(failed):
+            return None
+
+        capture_dir = os.path.join(self.path, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{label}")
+        try:
+            os.makedirs(capture_dir, exist_ok=True)
+            with open(os.path.join(capture_dir, "page_source.html"), 'w', encoding='utf-8') as f:
+                f.write(driver.page_source)
+            driver.save_screenshot(os.path.join(capture_dir, "screenshot.png"))
+            logging.info(f"Saved debug artifacts to {capture_dir}")
+        except Exception as e:
+            logging.warning(f"Could not save debug artifacts: {e}")
+        self._rotate()
+        return capture_dir
+
+    def _rotate(self):
+        """Delete the oldest captures beyond max_entries"""
+        with self._lock:
+            try:
+                entries = sorted(os.listdir(self.path))
+            except OSError:
+                return
+            for name in entries[:max(0, len(entries) - self.max_entries)]:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
@@ -0,0 +1,242 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+import config
+
+class DiskQuotaExceeded(Exception):
+    """Raised when no scratch space frees up under the download quota in time"""
+
+def directory_size(path):
+    """Get the total size in bytes of the files under a directory"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class DiskManager:
+    """
+    Owns DOWNLOAD_PATH. Every download attempt works in a scratch directory
+    leased from here, and the lease is released (the directory deleted) once
+    its job is done.
+
+    A background reaper deletes leftovers nobody holds a lease on, e.g. from
+    a crash, once they are older than the lease time. Leased directories are
+    never reaped, however long their download or upload takes.
+    New leases wait while the download directory has no room left under its
+    byte quota, so a burst of big downloads slows down instead of filling the
+    disk. Usage is kept current between measurements: every lease reserves a
+    minimum number of bytes and bytes written into it are charged as they are
+    fetched. Optionally, scratch space for image posts goes to a tmpfs
+    directory while that has room.
+    """
+    def __init__(self, path=None, quota=None, lease_ttl=None, reap_interval=None, wait_timeout=None,
+                 tmpfs_path=None, tmpfs_quota=None, lease_reserve=None):
+        self.path = os.path.abspath(path or config.DOWNLOAD_PATH)
+        self.quota = quota if quota is not None else config.DISK_QUOTA
+        self.lease_ttl = lease_ttl or config.DISK_LEASE_TTL
+        self.reap_interval = reap_interval or config.DISK_REAP_INTERVAL
+        self.wait_timeout = wait_timeout if wait_timeout is not None else config.DISK_QUOTA_WAIT
+        tmpfs_path = tmpfs_path if tmpfs_path is not None else config.DISK_TMPFS_PATH
+        self.tmpfs_path = os.path.abspath(tmpfs_path) if tmpfs_path else None
+        self.tmpfs_quota = tmpfs_quota if tmpfs_quota is not None else config.DISK_TMPFS_QUOTA
+        self.lease_reserve = lease_reserve if lease_reserve is not None else config.DISK_LEASE_RESERVE
+
+        self._leases = {}  # directory -> {"charged": bytes written so far}
+        self._usage = {self.path: 0}
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._reaper = None
+        self.waits = 0
+        self.reaped = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        if self.tmpfs_path:
+            try:
+                os.makedirs(self.tmpfs_path, exist_ok=True)
+                self._usage[self.tmpfs_path] = 0
+            except OSError as e:
+                logging.warning(f"Could not use tmpfs scratch directory {self.tmpfs_path}: {e}")
+                self.tmpfs_path = None
+
+    def start(self):
+        """Clear leftovers of earlier runs and start the background reaper"""
+        self.reap()
+        self._reaper = threading.Thread(target=self._reap_loop, name="disk-reaper", daemon=True)
+        self._reaper.start()
+
+    def _roots(self):
+        return [root for root in (self.path, self.tmpfs_path) if root]
+
+    def owns(self, directory):
+        """Check whether a directory is a scratch directory managed here"""
+        return os.path.dirname(os.path.abspath(directory)) in self._roots()
+
+    def _lease_dir(self, path):
+        """Get the scratch directory a path is in, or None if it isn't under a scratch root"""
+        path = os.path.abspath(path)
+        roots = self._roots()
+        parent = os.path.dirname(path)
+        while parent != path:
+            if parent in roots:
+                return path
+            path, parent = parent, os.path.dirname(parent)
+        return None
+
+    def _used(self, root):
+        """Bytes used under a root plus what its leases still reserve (call with the lock held)"""
+        reserved = sum(
+            max(0, self.lease_reserve - lease["charged"])
+            for directory, lease in self._leases.items()
+            if os.path.dirname(directory) == root
+        )
+        return self._usage.get(root, 0) + reserved
+
+    def _has_room(self, root, quota):
+        """Check whether one more lease fits under a root's quota (call with the lock held)"""
+        if quota <= 0:
+            return True
+        used = self._used(root)
+        # A single lease is always allowed, so a quota below the reserve can't block everything
+        return used == 0 or used + self.lease_reserve <= quota
+
+    def _pick_root(self, prefer_tmpfs):
+        """Get the root a new lease fits under, or None if it has to wait (call with the lock held)"""
+        if prefer_tmpfs and self.tmpfs_path and self._has_room(self.tmpfs_path, self.tmpfs_quota):
+            return self.tmpfs_path
+        if self._has_room(self.path, self.quota):
+            return self.path
+        return None
+
+    def _measure(self):
+        """Recompute the bytes used under every scratch root"""
+        usage = {root: directory_size(root) for root in self._roots()}
+        with self._lock:
+            self._usage = usage
+            self._lock.notify_all()
+        return usage
+
+    def lease(self, prefer_tmpfs=False):
+        """
+        Create a scratch directory for one download attempt. Waits while the
+        download directory has no room under its quota; raises
+        DiskQuotaExceeded if none frees up within the wait timeout.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while True:
+            with self._lock:
+                # Checking for room and reserving it happen under one lock, so a burst can't overshoot
+                root = self._pick_root(prefer_tmpfs)
+                if root is not None:
+                    directory = os.path.join(root, str(uuid.uuid4()))
+                    self._leases[directory] = {"charged": 0}
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DiskQuotaExceeded(f"Download directory uses {self._used(self.path)} bytes, no room under its quota of {self.quota} bytes")
+                if not waiting:
+                    waiting = True
+                    self.waits += 1
+                    logging.warning(f"Download directory is at its quota of {self.quota} bytes, waiting for space")
+                self._lock.wait(min(remaining, 1.0))
+
+            # Pick up files deleted by other means than release
+            self._measure()
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            with self._lock:
+                self._leases.pop(directory, None)
+                self._lock.notify_all()
+            raise
+        return directory
+
+    def charge(self, path, size):
+        """Count bytes written to a file in a scratch directory towards its quota"""
+        directory = self._lease_dir(path)
+        if directory is None:
+            return
+        with self._lock:
+            lease = self._leases.get(directory)
+            if lease is None:
+                return
+            lease["charged"] += size
+            root = os.path.dirname(directory)
+            self._usage[root] = self._usage.get(root, 0) + size
+
+    def release(self, directory):
+        """Delete a scratch directory and end its lease. Returns False if it isn't managed here."""
+        directory = os.path.abspath(directory)
+        if not self.owns(directory):
+            return False
+
+        size = directory_size(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+        with self._lock:
+            self._leases.pop(directory, None)
+            root = os.path.dirname(directory)
+            self._usage[root] = max(0, self._usage.get(root, 0) - size)
+            self._lock.notify_all()
+        return True
+
+    def reap(self):
+        """Delete unleased scratch directories older than the lease time"""
+        cutoff = time.time() - self.lease_ttl
+        for root in self._roots():
+            try:
+                entries = os.listdir(root)
+            except OSError:
+                continue
+            for name in entries:
+                directory = os.path.join(root, name)
+                with self._lock:
+                    # A held lease is only ended by its holder
+                    if directory in self._leases:
+                        continue
+                try:
+                    expired = os.path.getmtime(directory) <= cutoff
+                except OSError:
+                    continue
+                if expired:
+                    logging.info(f"Reaping abandoned scratch directory: {directory}")
+                    self.reaped += 1
+                    if os.path.isdir(directory):
+                        self.release(directory)
+                    else:
+                        try:
+                            os.remove(directory)
+                        except OSError:
+                            pass
+        self._measure()
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logging.error(f"Error reaping scratch directories: {e}")
+
+    def stats(self):
+        """Get lease counts and disk usage"""
+        with self._lock:
+            return {
+                "leases": len(self._leases),
+                "usage": dict(self._usage),
+                "reserved": {root: self._used(root) - self._usage.get(root, 0) for root in self._roots()},
+                "quota": self.quota,
+                "waits": self.waits,
+                "reaped": self.reaped
+            }
+
+    def close(self):
+        """Stop the background reaper"""
+        self._stop.set()
@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import config
+
+# Cancellation flag of the strategy attempt running on the current thread
+_attempt = threading.local()
+
+class AttemptCancelled(Exception):
+    """Raised instead of sending a request once the strategy attempt lost a hedged race"""
+
+def attempt_cancelled():
+    """Check whether the strategy attempt running on this thread lost a hedged race"""
+    event = getattr(_attempt, "cancel_event", None)
+    return event is not None and event.is_set()
+
+def current_attempt():
+    """Get the cancellation event of the strategy attempt running on this thread (None outside a hedged race)"""
+    return getattr(_attempt, "cancel_event", None)
+
+def run_in_attempt(cancel_event, fn, *args):
+    """Run fn on this thread as part of the attempt cancel_event belongs to, e.g. work handed to another pool"""
+    previous = getattr(_attempt, "cancel_event", None)
+    _attempt.cancel_event = cancel_event
+    try:
+        return fn(*args)
+    finally:
+        _attempt.cancel_event = previous
+
+def sleep_unless_cancelled(seconds):
+    """Sleep like time.sleep, but wake up early if this attempt is cancelled. Returns True if cancelled."""
+    event = getattr(_attempt, "cancel_event", None)
+    if event is None:
+        time.sleep(seconds)
+        return False
+    return event.wait(seconds)
+
+def parse_pair_delays(value):
+    """Parse per strategy pair hedge delays written as "first>second=seconds,..." """
+    delays = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        pair, seconds = item.split("=")
+        first, second = pair.split(">")
+        delays[(first.strip(), second.strip())] = float(seconds)
+    return delays
+
+class HedgedRunner:
+    """
+    Runs download strategies as a hedged race.
+
+    The first strategy starts right away. If it hasn't finished after the
+    hedge delay configured for (running strategy, next strategy), the next
+    one is launched in parallel, and so on. A strategy that fails makes the
+    next one start immediately. The first attempt that returns real media
+    wins; the others are cancelled (cooperatively, if already running) and
+    their results discarded.
+    """
+    def __init__(self, max_workers=None, default_delay=None, pair_delays=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or config.STRATEGY_HEDGE_WORKERS,
+            thread_name_prefix="hedge"
+        )
+        self.default_delay = default_delay if default_delay is not None else config.STRATEGY_HEDGE_DELAY
+        self.pair_delays = pair_delays if pair_delays is not None else parse_pair_delays(config.STRATEGY_HEDGE_DELAYS)
+
+        self._lock = threading.Lock()
+        self.hedges_fired = {}
+        self.hedges_won = {}
+
+    def delay_for(self, current, following):
+        """Get how long to wait on one strategy before hedging with the next"""
+        return self.pair_delays.get((current, following), self.default_delay)
+
+    def _run_attempt(self, attempt, name, cancel_event):
+        return run_in_attempt(cancel_event, attempt, name)
+
+    def run(self, order, attempt, is_success, discard):
+        """
+        Race the strategies in order. attempt(name) runs one strategy and returns
+        its files; discard(files) cleans up a result that won't be used.
+        Returns the winning files, else the first non-empty failed result, else None.
+        """
+        remaining = list(order)
+        pending = {}
+        cancel_events = {}
+        hedged = {}
+        fallback_files = None
+        next_launch_at = None
+        last_launched = None
+
+        def launch(is_hedge):
+            nonlocal next_launch_at, last_launched
+            name = remaining.pop(0)
+            if is_hedge:
+                pair = (last_launched, name)
+                hedged[name] = pair
+                with self._lock:
+                    self.hedges_fired[pair] = self.hedges_fired.get(pair, 0) + 1
+                logging.info(f"Hedging {last_launched} with {name}")
+            cancel_events[name] = threading.Event()
+            future = self.executor.submit(self._run_attempt, attempt, name, cancel_events[name])
+            pending[future] = name
+            last_launched = name
+            next_launch_at = time.monotonic() + self.delay_for(name, remaining[0]) if remaining else None
+
+        launch(False)
+        while pending:
+            timeout = max(0, next_launch_at - time.monotonic()) if next_launch_at is not None else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                launch(True)
+                continue
+
+            failed = False
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    files = future.result()
+                except Exception as e:
+                    logging.error(f"Error downloading with {name} method: {e}")
+                    files = None
+
+                if is_success(files):
+                    if name in hedged:
+                        with self._lock:
+                            self.hedges_won[hedged[name]] = self.hedges_won.get(hedged[name], 0) + 1
+                    self._cancel_losers(pending, cancel_events, discard)
+                    if fallback_files:
+                        discard(fallback_files)
+                    logging.info(f"{name} method won the hedged download")
+                    return files
+
+                failed = True
+                if files and fallback_files is None:
+                    fallback_files = files
+                elif files:
+                    discard(files)
+
+            # A failed attempt is replaced by the next strategy right away
+            if failed and remaining:
+                launch(False)
+
+        return fallback_files
+
+    def _cancel_losers(self, pending, cancel_events, discard):
+        """Cancel attempts that are still queued or running and clean up whatever they produce"""
+        for future, name in pending.items():
+            cancel_events[name].set()
+            if future.cancel():
+                continue
+
+            def cleanup(finished, name=name):
+                try:
+                    files = finished.result()
+                except Exception:
+                    return
+                if files:
+                    logging.info(f"Discarding result of cancelled {name} attempt")
+                    discard(files)
+
+            future.add_done_callback(cleanup)
+
+    def stats(self):
+        """Get how often each strategy pair hedged and how often the hedge won"""
+        with self._lock:
+            return {
+                f"{first}>{second}": {
+                    "fired": fired,
+                    "won": self.hedges_won.get((first, second), 0)
+                }
+                for (first, second), fired in self.hedges_fired.items()
+            }
+
+    def close(self):
+        """Stop accepting attempts; running ones finish in the background"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,181 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import cookiejar
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from hedging import AttemptCancelled, attempt_cancelled, current_attempt, run_in_attempt
+import config
+
+class _RejectAllCookiesPolicy(cookiejar.DefaultCookiePolicy):
+    """Cookie policy that never stores cookies (callers pass their own jar per request)"""
+    def set_ok(self, cookie, request):
+        return False
+
+def guess_extension(media_url):
+    """Guess a media file extension from its CDN URL"""
+    lowered = media_url.lower()
+    if '.mp4' in lowered:
+        return '.mp4'
+    if '.webp' in lowered:
+        return '.webp'
+    return '.jpg'  # Default to jpg for images
+
+class HttpClient:
+    """
+    Connection-pooled HTTP client shared by every download strategy.
+
+    The shared session keeps keep-alive connections to Instagram and its CDN
+    hosts open across requests. It never stores cookies itself: each caller
+    passes its own cookie jar, so one pool of connections serves every
+    strategy and account. Media files are fetched concurrently with a
+    per-host concurrency limit and large buffered writes. Every request goes
+    through the rate limiter, keyed by host and by the account it is made with,
+    and bytes written to scratch directories are charged to the disk manager.
+    """
+    def __init__(self, rate_limiter=None, pool_size=None, per_host_limit=None, chunk_size=None, fetch_workers=None, disk=None):
+        self.rate_limiter = rate_limiter
+        self.disk = disk
+        self.pool_size = pool_size or config.HTTP_POOL_SIZE
+        self.per_host_limit = per_host_limit or config.HTTP_PER_HOST_CONCURRENCY
+        self.chunk_size = chunk_size or config.HTTP_CHUNK_SIZE
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset(['GET']))
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.cookies.set_policy(_RejectAllCookiesPolicy())
+
+        self._fetch_executor = ThreadPoolExecutor(
+            max_workers=fetch_workers or config.HTTP_FETCH_WORKERS,
+            thread_name_prefix="fetch"
+        )
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _request(self, method, url, account, kwargs):
+        kwargs.setdefault('timeout', 15)
+        # An attempt that lost its hedged race (before or while waiting for its turn) sends nothing more
+        if attempt_cancelled() or (self.rate_limiter and self.rate_limiter.acquire(url, account)):
+            raise AttemptCancelled(f"Request to {url} cancelled")
+        response = self.session.request(method, url, **kwargs)
+        if self.rate_limiter:
+            self.rate_limiter.observe(url, account, response.status_code)
+        return response
+
+    def get(self, url, account=None, **kwargs):
+        """GET through the shared connection pool; account is the Instagram session the request is made with"""
+        return self._request('GET', url, account, kwargs)
+
+    def post(self, url, account=None, **kwargs):
+        """POST through the shared connection pool; account is the Instagram session the request is made with"""
+        return self._request('POST', url, account, kwargs)
+
+    def _host_limit(self, url):
+        host = urlparse(url).hostname or ""
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_limits[host]
+
+    def fetch_to_file(self, url, output_file, headers=None, cookies=None):
+        """Stream one media URL to a file. Returns the file path, or None if nothing was downloaded."""
+        try:
+            with self._host_limit(url):
+                response = self._request('GET', url, None, {'headers': headers, 'cookies': cookies, 'timeout': 30, 'stream': True})
+                try:
+                    if response.status_code != 200:
+                        logging.warning(f"Failed to download media, status code: {response.status_code}")
+                        return None
+                    with open(output_file, 'wb', buffering=self.chunk_size) as f:
+                        for chunk in response.iter_content(self.chunk_size):
+                            if attempt_cancelled():
+                                raise AttemptCancelled(f"Download of {url} cancelled")
+                            f.write(chunk)
+                            if self.disk:
+                                self.disk.charge(output_file, len(chunk))
+                finally:
+                    response.close()
+
+            # Verify the file was downloaded successfully
+            if os.path.getsize(output_file) == 0:
+                logging.warning(f"Downloaded file is empty: {output_file}")
+                os.remove(output_file)
+                return None
+
+            logging.info(f"Successfully downloaded media to {output_file}")
+            return output_file
+        except AttemptCancelled:
+            # Don't leave a partial file behind
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            return None
+        except Exception as e:
+            logging.error(f"Error downloading media {url}: {e}")
+            return None
+
+    def open_stream(self, url, headers=None, cookies=None):
+        """
+        Open a streaming GET for a media URL. Returns the response, or None if it failed;
+        the caller reads its body and closes it.
+        """
+        response = self._request('GET', url, None, {'headers': headers, 'cookies': cookies, 'timeout': 30, 'stream': True})
+        if response.status_code != 200:
+            logging.warning(f"Failed to open media stream, status code: {response.status_code}")
+            response.close()
+            return None
+        return response
+
+    def probe(self, url, headers=None, cookies=None):
+        """Check that a media URL can be fetched, without downloading it. Returns True if it can."""
+        try:
+            with self._host_limit(url):
+                response = self._request('HEAD', url, None, {'headers': headers, 'cookies': cookies, 'allow_redirects': True})
+                response.close()
+                if response.status_code == 405:
+                    # Hosts that don't answer HEAD are checked by opening the download instead
+                    response = self.open_stream(url, headers, cookies)
+                    if response is None:
+                        return False
+                    response.close()
+                    return True
+            if response.status_code != 200:
+                logging.warning(f"Media is not available, status code: {response.status_code}")
+                return False
+            return True
+        except AttemptCancelled:
+            return False
+        except Exception as e:
+            logging.error(f"Error checking media {url}: {e}")
+            return False
+
+    def probe_all(self, urls, headers=None, cookies=None):
+        """Check media URLs concurrently. Returns whether each one can be fetched, in the same order."""
+        # The fetch threads act on behalf of the caller's strategy attempt, so they stop when it is cancelled
+        cancel_event = current_attempt()
+        futures = [self._fetch_executor.submit(run_in_attempt, cancel_event, self.probe, url, headers, cookies) for url in urls]
+        return [future.result() for future in futures]
+
+    def fetch_all(self, items, headers=None, cookies=None):
+        """
+        Download (url, output_file) pairs concurrently.
+        Returns the files that were downloaded, in the same order as the items.
+        """
+        cancel_event = current_attempt()
+        futures = [
+            self._fetch_executor.submit(run_in_attempt, cancel_event, self.fetch_to_file, url, output_file, headers, cookies)
+            for url, output_file in items
+        ]
+        return [path for path in (future.result() for future in futures) if path]
+
+    def close(self):
+        """Close pooled connections and stop the fetch workers"""
+        self._fetch_executor.shutdown(wait=False)
+        self.session.close()
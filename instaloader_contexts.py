@@ -0,0 +1,71 @@
+import logging
+import threading
+from contextlib import contextmanager
+import instaloader
+
+class _LoaderSlot:
+    """One long-lived Instaloader and the cookie jar it was last loaded with"""
+    def __init__(self, loader):
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.cookies = None
+
+class InstaloaderContexts:
+    """
+    Long-lived Instaloader instances, one per Instagram account plus one
+    anonymous, reused across downloads.
+
+    Each instance keeps its HTTP session and login across calls, so a
+    download doesn't pay for building a new instance, reading the session
+    file or logging in. Instaloader isn't thread-safe, so every instance is
+    used by one download at a time; the target directory is passed per call.
+    """
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _new_loader(self):
+        return instaloader.Instaloader(
+            filename_pattern="{shortcode}",
+            download_videos=True,
+            download_video_thumbnails=False,
+            download_geotags=False,
+            download_comments=False,
+            save_metadata=False,
+            compress_json=False,
+            max_connection_attempts=3,
+            request_timeout=15
+        )
+
+    @contextmanager
+    def borrow(self, session=None):
+        """Borrow the Instaloader of an account (or the anonymous one for session=None)"""
+        key = session.username if session else None
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _LoaderSlot(self._new_loader())
+
+        with slot.lock:
+            # The session manager swaps in a new jar whenever an account logs in again
+            if session and slot.cookies is not session.cookies:
+                slot.loader.load_session(session.username, session.cookie_dict())
+                slot.cookies = session.cookies
+                logging.info(f"Loaded Instagram session of {session.username} into instaloader")
+            yield slot.loader
+
+    def download_post(self, shortcode, target, session=None):
+        """Download one post into the target directory"""
+        with self.borrow(session) as loader:
+            post = instaloader.Post.from_shortcode(loader.context, shortcode)
+            loader.download_post(post, target=target)
+
+    def close(self):
+        """Close the HTTP sessions of all instances"""
+        with self._lock:
+            slots = list(self._slots.values())
+            self._slots.clear()
+        for slot in slots:
+            with slot.lock:
+                slot.loader.close()
@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import logging
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import config
+
+# File types worth keeping in the cache (error/explanation files are never cached)
+CACHEABLE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.mp4', '.mov')
+
+class MediaCache:
+    """
+    Persistent on-disk media cache keyed by post shortcode.
+
+    Files are stored once under their SHA-256 content hash (blobs/), and a
+    small JSON index per shortcode (index/) lists the blobs that make up the
+    post. Everything is written to tmp/ first and published with os.replace,
+    so readers never see partially written files. Entries are evicted in
+    least-recently-used order once the cache grows past its byte budget.
+    """
+    def __init__(self, path=None, max_bytes=None, min_age=None):
+        self.path = os.path.abspath(path or config.MEDIA_CACHE_PATH)
+        self.max_bytes = max_bytes or config.MEDIA_CACHE_MAX_BYTES
+        self.min_age = min_age if min_age is not None else config.MEDIA_CACHE_MIN_AGE
+        self.blobs_dir = os.path.join(self.path, "blobs")
+        self.index_dir = os.path.join(self.path, "index")
+        self.tmp_dir = os.path.join(self.path, "tmp")
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # shortcode -> entry, least recently used first
+        self._blob_refs = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        for directory in (self.blobs_dir, self.index_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the in-memory index from disk, dropping leftovers of interrupted writes"""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        entries = []
+        for name in os.listdir(self.index_dir):
+            index_file = os.path.join(self.index_dir, name)
+            try:
+                with open(index_file, 'r') as f:
+                    data = json.load(f)
+                blobs = [os.path.join(self.blobs_dir, blob) for blob in data["blobs"]]
+                if not all(os.path.exists(blob) for blob in blobs):
+                    os.remove(index_file)
+                    continue
+                entries.append((os.path.getmtime(index_file), data["shortcode"], blobs))
+            except Exception as e:
+                logging.warning(f"Removing unreadable cache index {index_file}: {e}")
+                try:
+                    os.remove(index_file)
+                except OSError:
+                    pass
+
+        # Index mtimes are bumped on every hit, so they give us the LRU order
+        for last_used, shortcode, blobs in sorted(entries):
+            self._add_entry(shortcode, blobs, last_used)
+
+        # Remove blobs that no index refers to anymore
+        for root, _, names in os.walk(self.blobs_dir):
+            for name in names:
+                blob = os.path.join(root, name)
+                if blob not in self._blob_refs:
+                    os.remove(blob)
+
+        logging.info(f"Media cache loaded {len(self._entries)} posts ({self.total_bytes} bytes) from {self.path}")
+
+    def _add_entry(self, shortcode, blobs, last_used):
+        size = 0
+        for blob in blobs:
+            if blob not in self._blob_refs:
+                self._blob_refs[blob] = 0
+                self.total_bytes += os.path.getsize(blob)
+            self._blob_refs[blob] += 1
+            size += os.path.getsize(blob)
+        self._entries[shortcode] = {"blobs": blobs, "size": size, "last_used": last_used}
+
+    def _remove_entry(self, shortcode):
+        entry = self._entries.pop(shortcode)
+        try:
+            os.remove(self._index_file(shortcode))
+        except OSError:
+            pass
+        self._release_blobs(entry)
+
+    def _release_blobs(self, entry):
+        """Drop an entry's blob references, deleting blobs nothing else points to"""
+        for blob in entry["blobs"]:
+            self._blob_refs[blob] -= 1
+            if self._blob_refs[blob] == 0:
+                del self._blob_refs[blob]
+                try:
+                    self.total_bytes -= os.path.getsize(blob)
+                    os.remove(blob)
+                except OSError:
+                    pass
+
+    def _index_file(self, shortcode):
+        return os.path.join(self.index_dir, f"{shortcode}.json")
+
+    def is_cacheable(self, files):
+        """Check whether a download result contains only real media files"""
+        return bool(files) and all(f.lower().endswith(CACHEABLE_EXTENSIONS) for f in files)
+
+    def owns(self, file_path):
+        """Check whether a path lives inside the cache (and must not be deleted by callers)"""
+        return os.path.abspath(file_path).startswith(self.path + os.sep)
+
+    def get(self, shortcode):
+        """Get cached file paths for a shortcode, or None on a cache miss"""
+        with self._lock:
+            entry = self._entries.get(shortcode)
+            if entry is None or not all(os.path.exists(blob) for blob in entry["blobs"]):
+                if entry is not None:
+                    self._remove_entry(shortcode)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(shortcode)
+            entry["last_used"] = time.time()
+            self.hits += 1
+            try:
+                os.utime(self._index_file(shortcode))
+            except OSError:
+                pass
+            return list(entry["blobs"])
+
+    def _stage_file(self, file_path):
+        """Hash a file and move it into the cache's tmp dir; returns (tmp path, blob path)"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+        ext = os.path.splitext(file_path)[1].lower()
+        name = digest.hexdigest()
+        blob = os.path.join(self.blobs_dir, name[:2], f"{name}{ext}")
+
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4()}{ext}")
+        shutil.move(file_path, tmp_path)
+        return tmp_path, blob
+
+    def put(self, shortcode, files):
+        """
+        Move downloaded files into the cache and publish them under the shortcode.
+        Returns the cache-backed paths, in the same order as the given files.
+        """
+        staged = [self._stage_file(file_path) for file_path in files]
+        blobs = [blob for _, blob in staged]
+
+        tmp_index = os.path.join(self.tmp_dir, f"{uuid.uuid4()}.json")
+        with open(tmp_index, 'w') as f:
+            json.dump({
+                "shortcode": shortcode,
+                "blobs": [os.path.relpath(blob, self.blobs_dir) for blob in blobs],
+                "created": time.time()
+            }, f)
+
+        with self._lock:
+            # Publish blobs first (identical content is stored only once), then the index
+            for tmp_path, blob in staged:
+                if os.path.exists(blob):
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    os.replace(tmp_path, blob)
+            os.replace(tmp_index, self._index_file(shortcode))
+
+            previous = self._entries.pop(shortcode, None)
+            self._add_entry(shortcode, blobs, time.time())
+            if previous is not None:
+                self._release_blobs(previous)
+            self._evict()
+
+        logging.info(f"Cached {len(blobs)} files for {shortcode} (cache size: {self.total_bytes} bytes)")
+        return blobs
+
+    def _evict(self):
+        """Drop least recently used posts until the cache fits its byte budget"""
+        now = time.time()
+        for shortcode in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            # Keep recently served entries so in-flight sends can still open their files
+            if now - self._entries[shortcode]["last_used"] < self.min_age:
+                continue
+            self._remove_entry(shortcode)
+            logging.info(f"Evicted {shortcode} from media cache")
+
+    def stats(self):
+        """Get cache size and hit statistics"""
+        with self._lock:
+            return {
+                "posts": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
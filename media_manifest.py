@@ -0,0 +1,110 @@
+from collections import namedtuple
+
+def best_candidate(candidates):
+    """Pick the highest resolution entry from a list of Instagram image/video versions"""
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda x: x.get('width', 0) * x.get('height', 0))
+    return best.get('url')
+
+def urls_from_api_item(item):
+    """Get media URLs from an item returned by Instagram's private/web API (video_versions, image_versions2, carousel_media)"""
+    media_urls = []
+
+    carousel = item.get('carousel_media')
+    if carousel:
+        for carousel_item in carousel:
+            media_urls.extend(urls_from_api_item(carousel_item))
+        return media_urls
+
+    if item.get('video_versions'):
+        video_url = best_candidate(item['video_versions'])
+        if video_url:
+            media_urls.append(video_url)
+    elif item.get('image_versions2'):
+        image_url = best_candidate(item['image_versions2'].get('candidates', []))
+        if image_url:
+            media_urls.append(image_url)
+
+    return media_urls
+
+def urls_from_graphql_media(media):
+    """Get media URLs from a GraphQL shortcode_media object (video_url, display_url, edge_sidecar_to_children)"""
+    media_urls = []
+
+    edges = (media.get('edge_sidecar_to_children') or {}).get('edges', [])
+    if edges:
+        for edge in edges:
+            media_urls.extend(urls_from_graphql_media(edge.get('node', {})))
+        return media_urls
+
+    if media.get('video_url'):
+        media_urls.append(media['video_url'])
+    elif media.get('display_url'):
+        media_urls.append(media['display_url'])
+
+    return media_urls
+
+def find_post_media(data, shortcode):
+    """
+    Search a decoded JSON response for the post with the given shortcode
+    and return its media URLs, or None if the post isn't in the response
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if node.get('code') == shortcode or node.get('shortcode') == shortcode:
+                if 'video_versions' in node or 'image_versions2' in node or 'carousel_media' in node:
+                    return urls_from_api_item(node)
+                if 'display_url' in node or 'video_url' in node:
+                    return urls_from_graphql_media(node)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return None
+
+def guess_kind(url):
+    """Guess whether a CDN URL points to a video or an image"""
+    return "video" if '.mp4' in url.lower() else "image"
+
+def unescape_url(url):
+    """Undo the JSON escaping Instagram uses for URLs embedded in page source"""
+    return url.replace('\\u0026', '&').replace('\\/', '/')
+
+# One media file of a post
+MediaItem = namedtuple('MediaItem', ['url', 'kind', 'source'])
+
+class MediaManifest:
+    """
+    Ordered, de-duplicated list of the media items found for a post.
+    Items keep the order they were first seen in; duplicates are dropped in O(1).
+    """
+    def __init__(self, shortcode=None):
+        self.shortcode = shortcode
+        self.items = []
+        self._seen = set()
+
+    def add(self, url, kind=None, source=None):
+        """Add a media URL unless it is already in the manifest. Returns True if it was added."""
+        url = unescape_url(url)
+        if not url or url in self._seen:
+            return False
+        self._seen.add(url)
+        self.items.append(MediaItem(url, kind or guess_kind(url), source))
+        return True
+
+    def add_all(self, urls, source=None):
+        """Add several media URLs in order"""
+        for url in urls:
+            self.add(url, source=source)
+
+    def urls(self):
+        """Get the media URLs in manifest order"""
+        return [item.url for item in self.items]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
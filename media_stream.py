@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+class RemoteMedia(str):
+    """
+    A media file that hasn't been fetched from the CDN yet.
+
+    It behaves like the path the file would be downloaded to, so download
+    results can mix it with real files, and carries what is needed to fetch
+    it: the CDN URL and the headers and cookies of the strategy that found it.
+    The lock and fetched flag let requests sharing one result download it
+    to its path only once; shared marks media that more than one request
+    will send, which is fetched that way instead of streamed by each.
+    """
+    def __new__(cls, path, url=None, headers=None, cookies=None):
+        media = super().__new__(cls, path)
+        media.url = url
+        media.headers = headers
+        media.cookies = cookies
+        media.lock = threading.Lock()
+        media.fetched = False
+        media.shared = False
+        return media
+
+class AsyncResponseReader:
+    """
+    File-like object for Telethon's upload_file that reads a streaming HTTP
+    response one upload part at a time in a worker thread, so memory stays
+    bounded by the part size and the event loop never blocks on the network.
+    """
+    def __init__(self, response, name=None):
+        self.response = response
+        self.name = name
+
+    def _read(self, size):
+        if size is None or size < 0:
+            return self.response.raw.read(decode_content=True)
+
+        # Telethon needs every part but the last one to be exactly the requested size
+        parts = []
+        remaining = size
+        while remaining > 0:
+            data = self.response.raw.read(remaining, decode_content=True)
+            if not data:
+                break
+            parts.append(data)
+            remaining -= len(data)
+        return b"".join(parts)
+
+    async def read(self, size=-1):
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, size)
+
+    def close(self):
+        self.response.close()
@@ -0,0 +1,120 @@
+import re
+import json
+import codecs
+import logging
+from media_manifest import MediaManifest, urls_from_graphql_media
+
+class PageExtractor:
+    """
+    Single-pass, streaming media extractor for Instagram post pages.
+
+    Page text is fed in chunks and scanned once with one combined pattern that
+    recognises every known way media is embedded: the window._sharedData and
+    window.__additionalDataLoaded JSON blobs, "display_url"/"video_url" fields
+    (which also covers carousel_media entries) and bare scontent CDN URLs.
+    As soon as one of the JSON blobs yields the post's media, the manifest is
+    complete and the rest of the page doesn't need to be read.
+    """
+    PATTERN = re.compile(
+        r'window\._sharedData\s*=\s*(?P<shared_data>\{)'
+        r'|window\.__additionalDataLoaded\([^,]*,\s*(?P<additional_data>\{)'
+        r'|"(?P<field>display_url|video_url)":"(?P<field_url>[^"]+)"'
+        r'|(?P<cdn_url>https://scontent[^"\']+?\.(?:jpg|mp4|webp)[^"\'\s]*)'
+        r'|(?P<not_found>Page Not Found)'
+    )
+
+    # Matches must start this far before the end of the buffered text,
+    # so URLs split across chunk boundaries are never cut short
+    MARGIN = 8192
+
+    # Text before the scan position is dropped once it grows past this size
+    TRIM_SIZE = 1024 * 1024
+
+    def __init__(self, shortcode=None):
+        self.shortcode = shortcode
+        self.page_not_found = False
+        self.complete = False
+        self.chars_read = 0
+        self._structured = MediaManifest(shortcode)
+        self._loose = MediaManifest(shortcode)
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+
+    def feed(self, text, final=False):
+        """
+        Scan the next chunk of page text. Pass final=True with the last chunk.
+        Returns True once a complete manifest has been found and reading can stop.
+        """
+        if self.complete:
+            return True
+
+        self.chars_read += len(text)
+        self._buffer += text
+        safe_end = len(self._buffer) if final else len(self._buffer) - self.MARGIN
+
+        for match in self.PATTERN.finditer(self._buffer, self._pos):
+            if match.start() >= safe_end:
+                break
+
+            if match.group('shared_data') or match.group('additional_data'):
+                start = match.start('shared_data') if match.group('shared_data') else match.start('additional_data')
+                try:
+                    data, end = self._json.raw_decode(self._buffer, start)
+                except ValueError:
+                    if not final:
+                        # The JSON blob hasn't been fully received yet, resume here with the next chunk
+                        self._pos = match.start()
+                        return False
+                    logging.warning("Could not decode embedded page JSON")
+                    continue
+
+                if match.group('shared_data'):
+                    media = data.get('entry_data', {}).get('PostPage', [{}])[0].get('graphql', {}).get('shortcode_media', {})
+                    self._structured.add_all(urls_from_graphql_media(media or {}), source='shared_data')
+                else:
+                    media = data.get('graphql', {}).get('shortcode_media', {})
+                    self._structured.add_all(urls_from_graphql_media(media or {}), source='additional_data')
+
+                if self._structured.items:
+                    self.complete = True
+                    return True
+                self._pos = end
+                continue
+
+            if match.group('field'):
+                self._loose.add(match.group('field_url'), source=match.group('field'))
+            elif match.group('cdn_url'):
+                self._loose.add(match.group('cdn_url'), source='cdn_url')
+            else:
+                self.page_not_found = True
+            self._pos = match.end()
+
+        self._pos = max(self._pos, safe_end)
+        if self._pos > self.TRIM_SIZE:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return False
+
+    def manifest(self):
+        """Get the media manifest: media from the embedded post JSON if found, else every media URL seen on the page"""
+        return self._structured if self._structured.items else self._loose
+
+def extract_from_response(response, shortcode=None, chunk_size=64 * 1024):
+    """
+    Stream a page response through a PageExtractor, stopping early once the
+    manifest is complete. The response should be opened with stream=True; it is closed here.
+    """
+    extractor = PageExtractor(shortcode)
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    try:
+        for chunk in response.iter_content(chunk_size):
+            if extractor.feed(decoder.decode(chunk)):
+                break
+        else:
+            extractor.feed(decoder.decode(b'', final=True), final=True)
+    finally:
+        response.close()
+
+    logging.info(f"Scanned {extractor.chars_read} characters of page content, found {len(extractor.manifest())} media URLs")
+    return extractor
@@ -0,0 +1,87 @@
+import asyncio
+import inspect
+import logging
+import random
+from telethon.tl import functions, types
+import config
+
+# Telegram upload parts are at most 512 KiB, and files over 10 MiB must be uploaded as "big" files
+PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+class _PartReader:
+    """Hands out consecutive upload parts of a local file or an async stream"""
+    def __init__(self, source):
+        self.source = source
+        self.file = None
+        self.next_part = 0
+        self.lock = asyncio.Lock()
+
+    async def read(self, total_parts):
+        """Get the next (part index, bytes), or (None, None) when all parts were handed out"""
+        async with self.lock:
+            if self.next_part >= total_parts:
+                return None, None
+            part = self.next_part
+            self.next_part += 1
+
+            if isinstance(self.source, str):
+                loop = asyncio.get_running_loop()
+                if self.file is None:
+                    self.file = await loop.run_in_executor(None, open, self.source, 'rb')
+                data = await loop.run_in_executor(None, self.file.read, PART_SIZE)
+            else:
+                data = self.source.read(PART_SIZE)
+                if inspect.isawaitable(data):
+                    data = await data
+            return part, data
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+async def upload_file_parallel(client, source, file_size, file_name, concurrency=None, progress=None):
+    """
+    Upload a file path or file-like stream with a Telethon client.
+
+    Big files are split into 512 KiB parts and several parts are sent
+    concurrently; MTProto pipelines the requests over the client's
+    connection, so transfer isn't bound by one request round trip at a time.
+    Small files use Telethon's regular upload. progress(sent, total) is
+    called (and awaited if it is a coroutine) as parts complete.
+    Returns an input file handle to pass to send_file.
+    """
+    if file_size <= BIG_FILE_SIZE:
+        return await client.upload_file(source, file_size=file_size, file_name=file_name, progress_callback=progress)
+
+    concurrency = concurrency or config.UPLOAD_PARALLELISM
+    total_parts = (file_size + PART_SIZE - 1) // PART_SIZE
+    file_id = random.getrandbits(63)
+    reader = _PartReader(source)
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+        while True:
+            part, data = await reader.read(total_parts)
+            if part is None:
+                return
+            if not data:
+                raise IOError(f"Upload source of {file_name} ended before part {part + 1}/{total_parts}")
+
+            if not await client(functions.upload.SaveBigFilePartRequest(file_id, part, total_parts, data)):
+                raise IOError(f"Telegram rejected part {part + 1}/{total_parts} of {file_name}")
+
+            sent += len(data)
+            if progress:
+                result = progress(sent, file_size)
+                if inspect.isawaitable(result):
+                    await result
+
+    logging.info(f"Uploading {file_name} ({file_size} bytes) in {total_parts} parts, {concurrency} at a time")
+    try:
+        await asyncio.gather(*[worker() for _ in range(min(concurrency, total_parts))])
+    finally:
+        reader.close()
+
+    return types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
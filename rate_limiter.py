@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+from hedging import sleep_unless_cancelled
+import config
+
+# Instagram's media CDN is spread over many hostnames that share one limit
+CDN_HOST_SUFFIXES = ('cdninstagram.com', 'fbcdn.net')
+
+def limit_key(url):
+    """Get the rate limit key of a destination URL"""
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    if host.endswith(CDN_HOST_SUFFIXES):
+        return "cdn"
+    if '/graphql' in parsed.path:
+        return f"{host}/graphql"
+    return host
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate adapts to the responses it sees:
+    additive increase after successes, multiplicative decrease on throttling.
+    """
+    def __init__(self, rate, burst, max_rate, min_rate):
+        self.initial_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self, now):
+        """Seconds until a token is available, without taking it"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now):
+        """Take a token, going into debt if none is left. Returns seconds to wait before using it."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def increase(self, step):
+        self.rate = min(self.max_rate, self.rate + step * self.initial_rate)
+
+    def decrease(self, factor):
+        self.rate = max(self.min_rate, self.rate * factor)
+        # Drop any saved-up burst so the next request really waits
+        self.tokens = min(self.tokens, 0.0)
+
+class RateLimiter:
+    """
+    Token bucket rate limits per destination host and per Instagram account.
+
+    Every request reserves a token from its host's bucket and, when made
+    with an account, from the account's bucket too. Rates grow slowly while
+    responses succeed and are cut on 429/401, so throughput settles just
+    below the point where Instagram starts throttling. Threads wait out
+    their reservation with a cancellable sleep; the download pool waits
+    asynchronously on the event loop before handing out new work.
+    """
+    def __init__(self, enabled=None, host_rate=None, cdn_rate=None, account_rate=None, burst=None,
+                 max_factor=None, min_rate=None, increase=None, decrease=None):
+        self.enabled = enabled if enabled is not None else config.RATE_LIMIT_ENABLED
+        self.host_rate = host_rate or config.RATE_LIMIT_HOST_RATE
+        self.cdn_rate = cdn_rate or config.RATE_LIMIT_CDN_RATE
+        self.account_rate = account_rate or config.RATE_LIMIT_ACCOUNT_RATE
+        self.burst = burst or config.RATE_LIMIT_BURST
+        self.max_factor = max_factor or config.RATE_LIMIT_MAX_FACTOR
+        self.min_rate = min_rate or config.RATE_LIMIT_MIN_RATE
+        self.increase = increase if increase is not None else config.RATE_LIMIT_INCREASE
+        self.decrease = decrease or config.RATE_LIMIT_DECREASE
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, rate):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, self.burst, rate * self.max_factor, self.min_rate)
+        return bucket
+
+    def _buckets_for(self, url, account):
+        key = limit_key(url)
+        buckets = [self._bucket(key, self.cdn_rate if key == "cdn" else self.host_rate)]
+        if account is not None and key != "cdn":
+            buckets.append(self._bucket(f"account:{account.username}", self.account_rate))
+        return buckets
+
+    def reserve(self, url, account=None):
+        """Reserve a request to a URL. Returns how many seconds to wait before sending it."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            return max(bucket.reserve(now) for bucket in self._buckets_for(url, account))
+
+    def acquire(self, url, account=None):
+        """Wait until a request to a URL may be sent. Returns True if the wait was cut short by cancellation."""
+        delay = self.reserve(url, account)
+        if delay <= 0:
+            return False
+        logging.debug(f"Rate limited {limit_key(url)} for {delay:.2f}s")
+        return sleep_unless_cancelled(delay)
+
+    async def wait_ready(self, url):
+        """Wait on the event loop until a request to a URL wouldn't be throttled, without reserving it"""
+        if not self.enabled:
+            return
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                delay = max(bucket.ready_in(now) for bucket in self._buckets_for(url, None))
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def observe(self, url, account=None, status_code=None):
+        """Adapt the rates after a response: back off on 429/401, speed up slowly on success"""
+        if not self.enabled or status_code is None:
+            return
+        with self._lock:
+            buckets = self._buckets_for(url, account)
+            if status_code in (401, 429):
+                for bucket in buckets:
+                    bucket.decrease(self.decrease)
+                rates = ", ".join(f"{bucket.rate:.2f}/s" for bucket in buckets)
+                logging.warning(f"Throttled by {limit_key(url)} (HTTP {status_code}), request rate lowered to {rates}")
+            elif status_code < 400:
+                for bucket in buckets:
+                    bucket.increase(self.increase)
+
+    def observe_error(self, url, account, error):
+        """Like observe, for errors that only carry the HTTP status in their message"""
+        text = str(error)
+        if "429" in text or "Too Many Requests" in text:
+            self.observe(url, account, 429)
+        elif "401" in text or "Unauthorized" in text:
+            self.observe(url, account, 401)
+
+    def stats(self):
+        """Get the current rate and tokens of every bucket"""
+        with self._lock:
+            return {
+                key: {"rate": bucket.rate, "tokens": bucket.tokens}
+                for key, bucket in self._buckets.items()
+            }
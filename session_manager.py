@@ -0,0 +1,246 @@
+import os
+import re
+import time
+import pickle
+import logging
+import threading
+from http import cookiejar
+import requests
+import instaloader
+import config
+
+# Session files live next to the code, as they always have
+SESSION_DIR = os.path.dirname(os.path.realpath(__file__))
+
+LOGIN_URL = "https://www.instagram.com/accounts/login/"
+
+def parse_accounts(value):
+    """Parse Instagram accounts written as "username:password,..." """
+    accounts = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        username, _, password = item.partition(":")
+        accounts.append((username.strip(), password))
+    return accounts
+
+def configured_accounts():
+    """Get every configured account: INSTAGRAM_USERNAME first, then INSTAGRAM_ACCOUNTS"""
+    accounts = []
+    if config.INSTAGRAM_USERNAME and config.INSTAGRAM_PASSWORD:
+        accounts.append((config.INSTAGRAM_USERNAME, config.INSTAGRAM_PASSWORD))
+    for username, password in parse_accounts(config.INSTAGRAM_ACCOUNTS):
+        if username and password and username not in [existing for existing, _ in accounts]:
+            accounts.append((username, password))
+    return accounts
+
+class InstagramSession:
+    """
+    One Instagram account and its canonical cookie jar.
+
+    The jar is persisted in instaloader's session file format (a pickled
+    cookie dict), and mirrored to a Netscape cookie file for yt-dlp.
+    """
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.session_file = os.path.join(SESSION_DIR, f"{username}_instagram_session")
+        self.cookie_file = f"{self.session_file}.cookies.txt"
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.needs_login = True
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+        self.uses = 0
+        self.failures = 0
+
+    def is_authenticated(self):
+        """Check whether the jar holds an Instagram session cookie"""
+        return self.cookies.get('sessionid') is not None
+
+    def cookie_dict(self):
+        """Get the account's cookies as a plain name -> value dict"""
+        return requests.utils.dict_from_cookiejar(self.cookies)
+
+    def set_cookies(self, cookies):
+        """Replace the account's cookies with a name -> value dict and persist them"""
+        jar = requests.cookies.RequestsCookieJar()
+        for name, value in cookies.items():
+            jar.set(name, value, domain='.instagram.com', path='/')
+        # Swapping the whole jar keeps requests already using the old one consistent
+        self.cookies = jar
+        self.save()
+
+    def load(self):
+        """Load the cookies saved for this account. Returns True if a session cookie was found."""
+        if not os.path.exists(self.session_file):
+            return False
+
+        try:
+            with open(self.session_file, 'rb') as f:
+                data = f.read()
+            try:
+                cookies = pickle.loads(data)
+            except Exception:
+                # Older versions of the bot also saved plain "name=value; ..." cookie strings here
+                cookies = dict(re.findall(r'(\w+)=([^;]+)', data.decode('utf-8', errors='replace')))
+                logging.info(f"Converting old cookie string session file for {self.username}")
+            self.set_cookies(cookies)
+        except Exception as e:
+            logging.warning(f"Could not load Instagram session for {self.username}: {e}")
+            return False
+
+        return self.is_authenticated()
+
+    def save(self):
+        """Write the cookies to the session file and the Netscape cookie file"""
+        try:
+            with open(self.session_file, 'wb') as f:
+                pickle.dump(self.cookie_dict(), f)
+
+            netscape_jar = cookiejar.MozillaCookieJar(self.cookie_file)
+            for cookie in self.cookies:
+                netscape_jar.set_cookie(cookie)
+            netscape_jar.save(ignore_discard=True, ignore_expires=True)
+        except Exception as e:
+            logging.warning(f"Failed to save Instagram session for {self.username}: {e}")
+
+    def login(self, rate_limiter=None):
+        """Log in with the account's credentials and take over the new session cookies"""
+        if rate_limiter:
+            rate_limiter.acquire(LOGIN_URL, self)
+        logging.info(f"Logging into Instagram with username: {self.username}")
+        loader = instaloader.Instaloader()
+        loader.login(self.username, self.password)
+        loader.save_session_to_file(self.session_file)
+        self.load()
+
+class SessionManager:
+    """
+    Keeps every configured Instagram account logged in and hands them out to
+    download strategies.
+
+    Accounts are picked least-recently-used (or round-robin). An account
+    that gets HTTP 401 or 429 is cooled down and skipped until the cooldown
+    ends; after a 401 it is also logged in again by the background refresher.
+    When no account is usable, strategies fall back to anonymous requests.
+    """
+    def __init__(self, accounts=None, selection=None, cooldown=None, refresh_interval=None, rate_limiter=None):
+        if accounts is None:
+            accounts = configured_accounts()
+        self.sessions = [InstagramSession(username, password) for username, password in accounts]
+        self.selection = selection or config.SESSION_SELECTION
+        self.cooldown = cooldown if cooldown is not None else config.SESSION_COOLDOWN
+        self.refresh_interval = refresh_interval if refresh_interval is not None else config.SESSION_REFRESH_INTERVAL
+        self.rate_limiter = rate_limiter
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def start(self):
+        """Load or create a session for every account and start the background refresher"""
+        for session in self.sessions:
+            if session.load():
+                session.needs_login = False
+                logging.info(f"Loaded Instagram session for {session.username}")
+            else:
+                self._login(session)
+
+        if self.sessions and self.refresh_interval > 0:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="session-refresh", daemon=True)
+            self._refresher.start()
+
+    def _login(self, session):
+        """Log an account in, cooling it down if that fails"""
+        try:
+            session.login(self.rate_limiter)
+        except Exception as e:
+            logging.error(f"Failed to login to Instagram as {session.username}: {e}")
+            if self.rate_limiter:
+                self.rate_limiter.observe_error(LOGIN_URL, session, e)
+            session.cooldown_until = time.monotonic() + self.cooldown
+            return False
+
+        if not session.is_authenticated():
+            logging.error(f"Instagram login for {session.username} did not return a session cookie")
+            session.cooldown_until = time.monotonic() + self.cooldown
+            return False
+
+        session.needs_login = False
+        logging.info(f"Successfully logged in to Instagram as {session.username}")
+        return True
+
+    def _refresh_loop(self):
+        """Log accounts in again once their cooldown after an authentication error is over"""
+        while not self._stop.wait(self.refresh_interval):
+            for session in self.sessions:
+                if self._stop.is_set():
+                    return
+                if session.needs_login and session.cooldown_until <= time.monotonic():
+                    self._login(session)
+
+    def acquire(self):
+        """Pick a logged-in account for a request, or None if no account can be used right now"""
+        now = time.monotonic()
+        with self._lock:
+            usable = [s for s in self.sessions if not s.needs_login and s.cooldown_until <= now]
+            if not usable:
+                return None
+
+            if self.selection == "round_robin":
+                for offset in range(len(self.sessions)):
+                    index = (self._next + offset) % len(self.sessions)
+                    if self.sessions[index] in usable:
+                        session = self.sessions[index]
+                        self._next = index + 1
+                        break
+            else:
+                session = min(usable, key=lambda s: s.last_used)
+
+            session.last_used = now
+            session.uses += 1
+            return session
+
+    def has_accounts(self):
+        """Check whether any Instagram account is configured"""
+        return bool(self.sessions)
+
+    def report(self, session, status_code):
+        """Tell the manager the HTTP status Instagram returned for a request made with an account"""
+        if session is None or status_code not in (401, 429):
+            return
+
+        with self._lock:
+            session.failures += 1
+            session.cooldown_until = time.monotonic() + self.cooldown
+            if status_code == 401:
+                session.needs_login = True
+        logging.warning(f"Instagram account {session.username} got HTTP {status_code}, cooling down for {self.cooldown}s")
+
+    def report_error(self, session, error):
+        """Like report, for errors that only carry the HTTP status in their message"""
+        text = str(error)
+        if "401" in text or "Unauthorized" in text:
+            self.report(session, 401)
+        elif "429" in text or "Too Many Requests" in text:
+            self.report(session, 429)
+
+    def stats(self):
+        """Get usage and cooldown state of every account"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                session.username: {
+                    "uses": session.uses,
+                    "failures": session.failures,
+                    "logged_in": not session.needs_login,
+                    "cooldown_remaining": max(0.0, session.cooldown_until - now)
+                }
+                for session in self.sessions
+            }
+
+    def close(self):
+        """Stop the background refresher"""
+        self._stop.set()
@@ -0,0 +1,93 @@
+import re
+import random
+import logging
+import threading
+from collections import defaultdict, deque
+import config
+
+def get_url_type(url):
+    """Get the kind of Instagram link (p, reel, tv or stories)"""
+    match = re.search(r'instagram\.com/(p|reel|tv|stories)/', url)
+    return match.group(1) if match else "other"
+
+class StrategyStats:
+    """
+    Sliding window of download strategy outcomes, broken down by URL type.
+
+    Strategies are ordered by expected time-to-success (average attempt
+    latency divided by smoothed success rate), which is the order that
+    minimises the expected total time of a sequential fallback chain.
+    With a small probability a random strategy is moved to the front so
+    strategies that are currently ranked low keep getting measured.
+    """
+    def __init__(self, window=None, exploration_rate=None):
+        self.window = window or config.STRATEGY_WINDOW
+        self.exploration_rate = exploration_rate if exploration_rate is not None else config.STRATEGY_EXPLORATION_RATE
+        self._outcomes = defaultdict(lambda: deque(maxlen=self.window))
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Call listener(url_type, strategy, success, latency) for every recorded outcome"""
+        self._listeners.append(listener)
+
+    def record(self, url_type, strategy, success, latency):
+        """Record the outcome of one strategy attempt"""
+        with self._lock:
+            self._outcomes[(url_type, strategy)].append((bool(success), latency))
+        for listener in self._listeners:
+            try:
+                listener(url_type, strategy, bool(success), latency)
+            except Exception as e:
+                logging.error(f"Strategy outcome listener failed: {e}")
+
+    def expected_cost(self, url_type, strategy):
+        """Expected seconds spent per successful download with this strategy, or None without data"""
+        with self._lock:
+            outcomes = list(self._outcomes.get((url_type, strategy), ()))
+        if not outcomes:
+            return None
+
+        successes = sum(1 for success, _ in outcomes if success)
+        average_latency = sum(latency for _, latency in outcomes) / len(outcomes)
+        # Laplace smoothing keeps a single early failure from ranking a strategy last forever
+        success_rate = (successes + 1) / (len(outcomes) + 2)
+        return average_latency / success_rate
+
+    def order(self, url_type, strategies):
+        """
+        Order strategy names for a request. Strategies without any data yet keep
+        their default position at the front so they get measured first.
+        """
+        untried = []
+        ranked = []
+        for position, strategy in enumerate(strategies):
+            cost = self.expected_cost(url_type, strategy)
+            if cost is None:
+                untried.append(strategy)
+            else:
+                ranked.append((cost, position, strategy))
+
+        ordered = untried + [strategy for _, _, strategy in sorted(ranked)]
+
+        if len(ordered) > 1 and random.random() < self.exploration_rate:
+            explored = random.choice(ordered[1:])
+            ordered.remove(explored)
+            ordered.insert(0, explored)
+
+        return ordered
+
+    def snapshot(self):
+        """Get success rate, average latency and sample count for every strategy and URL type"""
+        with self._lock:
+            items = [(key, list(outcomes)) for key, outcomes in self._outcomes.items()]
+
+        report = {}
+        for (url_type, strategy), outcomes in items:
+            successes = sum(1 for success, _ in outcomes if success)
+            report.setdefault(url_type, {})[strategy] = {
+                "samples": len(outcomes),
+                "success_rate": successes / len(outcomes),
+                "avg_latency": sum(latency for _, latency in outcomes) / len(outcomes)
+            }
+        return report
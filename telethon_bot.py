@@ -1,13 +1,16 @@
 import os
 import re
 import logging
+import mimetypes
 import asyncio
 import time
-from telethon import TelegramClient, events, Button
+from telethon import TelegramClient, events, Button, types, errors, utils
 import config
-from database import Database
-from downloader import InstagramDownloader
-import shutil
+from database import AsyncDatabase
+from downloader import InstagramDownloader, extract_shortcode
+from worker_pool import DownloadPool
+from media_stream import RemoteMedia, AsyncResponseReader
+from parallel_upload import upload_file_parallel, BIG_FILE_SIZE
 
 # Configure logging
 logging.basicConfig(
@@ -17,11 +20,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize the database
-db = Database()
+db = AsyncDatabase()
 
 # Initialize the downloader
 downloader = InstagramDownloader()
 
+# Initialize the download worker pool (keeps blocking downloads off the event loop)
+download_pool = DownloadPool(downloader)
+
+# Strategy outcomes go to the database's event log for the analytics rollups
+downloader.strategy_stats.add_listener(db.log_strategy_outcome)
+
 # Initialize the Telegram client (bot)
 bot = TelegramClient(
     'instagram_downloader_bot_telethon',
@@ -29,6 +38,263 @@ bot = TelegramClient(
     config.API_HASH
 )
 
+# Captions for each kind of media we send
+MEDIA_CAPTIONS = {
+    "photo": "Instagram Photo",
+    "video": "Instagram Video",
+    "media": "Instagram Media"
+}
+
+# Telegram albums hold at most this many photos/videos
+ALBUM_SIZE = 10
+
+def album_media_type(file_path):
+    """Get whether a file can go into an album as a photo or a video (None if it can't)"""
+    if file_path.endswith(('.jpg', '.jpeg', '.png')):
+        return "photo"
+    if file_path.endswith(('.mp4', '.mov')):
+        return "video"
+    return None
+
+def sent_media_type(file_path):
+    """Get the media type a file is sent (and its reference stored) as"""
+    if file_path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+        return "photo"
+    if file_path.endswith(('.mp4', '.mov', '.avi')):
+        return "video"
+    return "media"
+
+def matches_sent_refs(files, refs):
+    """
+    Check whether a fresh download lines up with the references of the items already sent:
+    the same number of items, and the same media type (and size, for files on disk) at each of
+    their positions. If not, the post changed or came back differently and positions can't be trusted.
+    """
+    for ref in refs:
+        if ref["total"] != len(files):
+            return False
+        file_path = files[ref["index"]]
+        if sent_media_type(file_path) != ref["media_type"]:
+            return False
+        if ref.get("size") and os.path.isfile(file_path) and os.path.getsize(file_path) != ref["size"]:
+            return False
+    return True
+
+def chunks(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def save_file_ref(shortcode, index, total, media_type, message, file_size):
+    """Remember the uploaded file of a sent message so it can be re-sent without uploading again"""
+    media = message.photo or message.document
+    if media is None:
+        return
+    
+    db.save_file_ref(shortcode, index, total, "telethon", media_type, {
+        "kind": "photo" if message.photo else "document",
+        "id": media.id,
+        "access_hash": media.access_hash,
+        "file_reference": media.file_reference
+    }, file_size)
+
+async def send_file_refs(user_id, shortcode, url):
+    """
+    Re-send a post from stored Telegram file references.
+    Returns whether the whole post was sent and the references of the items that were, so that
+    after missing or stale references only the rest has to be downloaded and sent.
+    """
+    refs = await db.get_file_refs(shortcode, "telethon")
+    delivered = []
+    if not refs:
+        return False, delivered
+    
+    def input_media(ref):
+        data = ref["ref"]
+        if data["kind"] == "photo":
+            return types.InputPhoto(id=data["id"], access_hash=data["access_hash"], file_reference=data["file_reference"])
+        return types.InputDocument(id=data["id"], access_hash=data["access_hash"], file_reference=data["file_reference"])
+    
+    # Carousels of photos/videos go out as albums, like the first time they were sent
+    if len(refs) > 1 and all(ref["media_type"] in ("photo", "video") for ref in refs):
+        groups = chunks(refs, ALBUM_SIZE)
+    else:
+        groups = [[ref] for ref in refs]
+    
+    try:
+        for group in groups:
+            media = [input_media(ref) for ref in group]
+            await bot.send_file(
+                user_id,
+                media if len(media) > 1 else media[0],
+                caption=f"{MEDIA_CAPTIONS[group[0]['media_type']]}\n{url}"
+            )
+            for ref in group:
+                delivered.append(ref)
+                db.log_download(user_id, url, ref["_id"], ref.get("size", 0))
+    except errors.RPCError as e:
+        # Expired or invalid references fall back to a normal download and upload of the items not sent yet
+        logger.warning(f"Stored file references for {shortcode} are no longer valid: {e}")
+        sent = {ref["index"] for ref in delivered}
+        db.delete_file_refs(shortcode, "telethon", [ref["index"] for ref in refs if ref["index"] not in sent])
+        return False, delivered
+    
+    return True, delivered
+
+async def open_remote_media(media):
+    """
+    Prepare a CDN file for sending: an open streaming response if its size is known up front,
+    else the file downloaded to disk. Returns (source, size), or (None, 0) if it couldn't be fetched.
+    Media shared by several requests is always downloaded, once for all of them.
+    """
+    loop = asyncio.get_running_loop()
+    if media.shared or media.fetched:
+        path = await loop.run_in_executor(None, downloader.materialize, media)
+        return path, os.path.getsize(path) if path else 0
+    
+    response = await loop.run_in_executor(None, downloader.open_media_stream, media)
+    if response is None:
+        return None, 0
+    
+    # Telegram needs the exact size before the upload starts
+    size = int(response.headers.get('Content-Length') or 0)
+    if size and not response.headers.get('Content-Encoding'):
+        return response, size
+    
+    response.close()
+    path = await loop.run_in_executor(None, downloader.materialize, media)
+    return path, os.path.getsize(path) if path else 0
+
+async def upload_source(source, file_path, file_size, progress=None):
+    """
+    Get what to pass to send_file: a small file path as is, otherwise the file
+    or streaming response uploaded here (big files in parallel parts)
+    """
+    file_name = os.path.basename(file_path)
+    if isinstance(source, str):
+        if file_size <= BIG_FILE_SIZE:
+            return source
+        return await upload_file_parallel(bot, source, file_size, file_name, progress=progress)
+    
+    reader = AsyncResponseReader(source, file_name)
+    try:
+        return await upload_file_parallel(bot, reader, file_size, file_name, progress=progress)
+    finally:
+        reader.close()
+
+def upload_progress(processing_msg, file_name, interval=3):
+    """Get a progress callback that shows upload progress in the processing message every few seconds"""
+    last_update = [0.0]
+    
+    async def progress(sent, total):
+        now = time.monotonic()
+        if now - last_update[0] < interval or sent >= total:
+            return
+        last_update[0] = now
+        try:
+            await bot.edit_message(processing_msg, f"Uploading {file_name}... {sent * 100 // total}% ({sent / (1024 * 1024):.1f} of {total / (1024 * 1024):.1f} MB)")
+        except Exception as e:
+            logger.debug(f"Could not update upload progress: {e}")
+    return progress
+
+def video_attributes(file_path):
+    """Read duration and dimensions of a local video, which files uploaded in parts don't carry"""
+    if isinstance(file_path, RemoteMedia):
+        return None
+    try:
+        return utils.get_attributes(file_path, supports_streaming=True)[0]
+    except Exception:
+        return None
+
+def album_video(input_file, file_path):
+    """Wrap an uploaded album video with the attributes send_file gives a single video"""
+    attributes = video_attributes(file_path) or [
+        types.DocumentAttributeVideo(duration=0, w=1, h=1, supports_streaming=True),
+        types.DocumentAttributeFilename(os.path.basename(file_path))
+    ]
+    return types.InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=mimetypes.guess_type(file_path)[0] or 'video/mp4',
+        attributes=attributes
+    )
+
+def too_large_message(file_size):
+    """Tell the user a video is over the upload size limit"""
+    return f"Video file is too large ({file_size / (1024 * 1024):.2f} MB). Telegram has a {config.MAX_UPLOAD_SIZE // (1024 * 1024)}MB limit for bots."
+
+async def prepare_upload(file_path):
+    """Get the source and size of a file to send; CDN files are opened for streaming"""
+    if isinstance(file_path, RemoteMedia):
+        source, file_size = await open_remote_media(file_path)
+        if source is None:
+            raise IOError(f"Could not fetch {file_path.url}")
+        return source, file_size
+    return file_path, os.path.getsize(file_path)
+
+def close_source(source):
+    """Close a streaming source that is no longer needed"""
+    if source is not None and not isinstance(source, str):
+        source.close()
+
+async def send_album(event, user_id, url, files, indexes, shortcode, remember_refs, processing_msg=None):
+    """
+    Upload photos/videos in parallel, then send them as one album.
+    Returns the indexes (into files) of the items that were delivered.
+    """
+    sizes = {}
+    
+    async def upload(index):
+        file_path = files[index]
+        source, file_size = await prepare_upload(file_path)
+        sizes[index] = file_size
+        try:
+            if album_media_type(file_path) == "video" and file_size > config.MAX_UPLOAD_SIZE:
+                await event.respond(too_large_message(file_size))
+                return None
+            progress = upload_progress(processing_msg, os.path.basename(file_path)) if processing_msg else None
+            input_file = await upload_source(source, file_path, file_size, progress)
+            if isinstance(input_file, str):
+                input_file = await bot.upload_file(input_file)
+            if album_media_type(file_path) == "video":
+                # Without its attributes a video in an album arrives as a 0 second, 1x1 file that can't stream
+                return album_video(input_file, file_path)
+            return input_file
+        finally:
+            close_source(source)
+    
+    results = await asyncio.gather(*[upload(index) for index in indexes], return_exceptions=True)
+    uploaded = []
+    for index, result in zip(indexes, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error uploading file {os.path.basename(files[index])}: {result}")
+            await event.respond(f"Error sending file: {os.path.basename(files[index])}")
+        elif result is not None:
+            uploaded.append((index, result))
+    if not uploaded:
+        return []
+    
+    first_type = album_media_type(files[uploaded[0][0]])
+    messages = await bot.send_file(
+        user_id,
+        [input_file for _, input_file in uploaded] if len(uploaded) > 1 else uploaded[0][1],
+        caption=f"{MEDIA_CAPTIONS[first_type]}\n{url}"
+    )
+    if not isinstance(messages, list):
+        messages = [messages]
+    logger.info(f"Sent album of {len(uploaded)} files")
+    
+    for (index, _), message in zip(uploaded, messages):
+        if remember_refs:
+            save_file_ref(shortcode, index, len(files), album_media_type(files[index]), message, sizes[index])
+        db.log_download(user_id, url, files[index], sizes[index])
+    return [index for index, _ in uploaded]
+
+def format_stats(stats):
+    """Format a user's download statistics"""
+    text = f"Your Statistics\n\n- Total Downloads: {stats['downloads_count']}\n- Data Received: {stats['bytes_delivered'] / (1024 * 1024):.1f} MB"
+    if stats['last_download']:
+        text += f"\n- Last Download: {stats['last_download'].strftime('%Y-%m-%d %H:%M')} UTC"
+    return text
+
 # Command handlers
 @bot.on(events.NewMessage(pattern='/start'))
 async def start_command(event):
@@ -95,9 +361,9 @@ async def stats_command(event):
         user_id = user.id
         logger.info(f"Received /stats command from user: {user_id}")
         
-        stats = db.get_user_stats(user_id)
+        stats = await db.get_user_stats(user_id)
         
-        stats_text = f"Your Statistics\n\n- Total Downloads: {stats['downloads_count']}"
+        stats_text = format_stats(stats)
         
         await event.respond(stats_text)
         logger.info(f"Sent stats to user: {user_id}")
@@ -114,8 +380,8 @@ async def handle_callback_query(event):
         logger.info(f"Received callback query with data '{data}' from user: {user_id}")
         
         if data == 'stats':
-            stats = db.get_user_stats(user_id)
-            stats_text = f"Your Statistics\n\n- Total Downloads: {stats['downloads_count']}"
+            stats = await db.get_user_stats(user_id)
+            stats_text = format_stats(stats)
             await event.respond(stats_text)
         
         elif data == 'help':
@@ -167,89 +433,132 @@ async def download_media(event):
         url = url_match.group(1)
         logger.info(f"Extracted URL: {url}")
         
+        # Re-send previously uploaded media without downloading or uploading it again
+        shortcode = extract_shortcode(url)
+        delivered = []
+        if shortcode:
+            complete, delivered = await send_file_refs(user_id, shortcode, url)
+            if complete:
+                logger.info(f"Sent {shortcode} from stored file references to user: {user_id}")
+                return
+        
         # Send processing message
         processing_msg = await event.respond("Processing your Instagram link... Please wait.")
         
         # Download the media
         try:
             start_time = time.time()
-            files = downloader.download(url)
-            download_time = time.time() - start_time
-            
-            if not files:
-                await bot.edit_message(processing_msg, "⚠️ Could not download this Instagram post. Instagram may be blocking our requests (HTTP 401). Please try another link.")
-                logger.warning(f"Failed to download media from URL: {url}")
-                return
-            
-            logger.info(f"Successfully downloaded {len(files)} files from {url}")
-            
-            # Send success message
-            await bot.edit_message(processing_msg, f"Download successful! ({len(files)} files)\nTime taken: {download_time:.2f} seconds\n\nUploading to Telegram...")
-            
-            # Send media files to user
-            for file_path in files:
-                try:
-                    file_size = os.path.getsize(file_path)
-                    file_name = os.path.basename(file_path)
-                    logger.info(f"Sending file: {file_name} ({file_size} bytes)")
-                    
-                    # Check if the file is a text file with error messages
-                    if file_path.endswith('.txt'):
-                        with open(file_path, 'r') as f:
-                            error_content = f.read()
+            job = await download_pool.submit(url, stream=config.STREAM_UPLOADS)
+            try:
+                files = await job
+                download_time = time.time() - start_time
+                
+                if not files:
+                    await bot.edit_message(processing_msg, "⚠️ Could not download this Instagram post. Instagram may be blocking our requests (HTTP 401). Please try another link.")
+                    logger.warning(f"Failed to download media from URL: {url}")
+                    return
+                
+                logger.info(f"Successfully downloaded {len(files)} files from {url}")
+                
+                # Send success message
+                await bot.edit_message(processing_msg, f"Download successful! ({len(files)} files)\nTime taken: {download_time:.2f} seconds\n\nUploading to Telegram...")
+                
+                # Send media files to user (only complete media results are remembered for re-sending)
+                remember_refs = shortcode and not any(f.endswith('.txt') for f in files)
+                
+                # Photos and videos of a carousel go out as albums, everything else one by one
+                # (items already re-sent from stored references are skipped)
+                handled = set()
+                if delivered:
+                    if matches_sent_refs(files, delivered):
+                        handled = {ref["index"] for ref in delivered}
+                    else:
+                        # Everything goes out again and its references are stored anew
+                        logger.info(f"Download of {shortcode} doesn't line up with the items already sent, sending all of it")
+                        db.delete_file_refs(shortcode, "telethon")
+                album_indexes = [index for index, file_path in enumerate(files) if album_media_type(file_path) and index not in handled]
+                if len(album_indexes) > 1:
+                    for chunk in chunks(album_indexes, ALBUM_SIZE):
+                        try:
+                            await send_album(event, user_id, url, files, chunk, shortcode, remember_refs, processing_msg)
+                        except Exception as e:
+                            logger.error(f"Error sending album to user: {e}")
+                            await event.respond("Error sending album")
+                        handled.update(chunk)
+                
+                for index, file_path in enumerate(files):
+                    if index in handled:
+                        continue
+                    source = file_path
+                    try:
+                        file_name = os.path.basename(file_path)
+                        # CDN files are streamed straight into the upload
+                        source, file_size = await prepare_upload(file_path)
+                        logger.info(f"Sending file: {file_name} ({file_size} bytes)")
                         
-                        # If it contains an error message, send a more user-friendly explanation
-                        if "401" in error_content or "Unauthorized" in error_content:
-                            await event.respond("⚠️ **Instagram Authentication Error**\n\nInstagram is requiring authentication to access this post. This may happen if:\n\n• The post is from a private account\n• Instagram is enforcing regional restrictions\n• Instagram has temporarily limited access to their API\n\nPlease try a different post or try again later.")
-                            continue
-                        elif "download_failed" in file_path or "post_unavailable" in file_path:
-                            await event.respond("⚠️ **Download Failed**\n\nThis Instagram post could not be downloaded. Instagram may have restricted access to this content.")
-                            continue
-                    
-                    # Check file extension
-                    if file_path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                        await bot.send_file(
-                            user_id,
-                            file_path,
-                            caption=f"Instagram Photo\n{url}"
-                        )
-                    elif file_path.endswith(('.mp4', '.mov', '.avi')):
-                        if file_size > 50 * 1024 * 1024:  # If file size > 50MB
-                            await event.respond(f"Video file is too large ({file_size / (1024 * 1024):.2f} MB). Telegram has a 50MB limit for bots.")
+                        # Check if the file is a text file with error messages
+                        if file_path.endswith('.txt'):
+                            with open(file_path, 'r') as f:
+                                error_content = f.read()
+                            
+                            # If it contains an error message, send a more user-friendly explanation
+                            if "401" in error_content or "Unauthorized" in error_content:
+                                await event.respond("⚠️ **Instagram Authentication Error**\n\nInstagram is requiring authentication to access this post. This may happen if:\n\n• The post is from a private account\n• Instagram is enforcing regional restrictions\n• Instagram has temporarily limited access to their API\n\nPlease try a different post or try again later.")
+                                continue
+                            elif "download_failed" in file_path or "post_unavailable" in file_path:
+                                await event.respond("⚠️ **Download Failed**\n\nThis Instagram post could not be downloaded. Instagram may have restricted access to this content.")
+                                continue
+                        
+                        # Check file extension
+                        message = None
+                        if file_path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                            media_type = "photo"
+                            message = await bot.send_file(
+                                user_id,
+                                await upload_source(source, file_path, file_size),
+                                caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}"
+                            )
+                        elif file_path.endswith(('.mp4', '.mov', '.avi')):
+                            media_type = "video"
+                            if file_size > config.MAX_UPLOAD_SIZE:
+                                await event.respond(too_large_message(file_size))
+                            else:
+                                message = await bot.send_file(
+                                    user_id,
+                                    await upload_source(source, file_path, file_size, upload_progress(processing_msg, file_name)),
+                                    caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}",
+                                    attributes=video_attributes(file_path),
+                                    supports_streaming=True
+                                )
                         else:
-                            await bot.send_file(
+                            media_type = "media"
+                            message = await bot.send_file(
                                 user_id,
-                                file_path,
-                                caption=f"Instagram Video\n{url}"
+                                await upload_source(source, file_path, file_size),
+                                caption=f"{MEDIA_CAPTIONS[media_type]}\n{url}"
                             )
-                    else:
-                        await bot.send_file(
-                            user_id,
-                            file_path,
-                            caption=f"Instagram Media\n{url}"
-                        )
-                    
-                    logger.info(f"Successfully sent file: {file_name}")
+                        
+                        logger.info(f"Successfully sent file: {file_name}")
+                        
+                        if remember_refs and message is not None:
+                            save_file_ref(shortcode, index, len(files), media_type, message, file_size)
+                        
+                        # Log successful download
+                        db.log_download(user_id, url, file_path, file_size if message is not None else 0)
                     
-                    # Log successful download
-                    db.log_download(user_id, url, file_path)
+                    except Exception as e:
+                        logger.error(f"Error sending file to user: {e}")
+                        await event.respond(f"Error sending file: {file_name}")
+                    finally:
+                        # Close a stream that wasn't uploaded (e.g. a video over the size limit)
+                        close_source(source)
                 
-                except Exception as e:
-                    logger.error(f"Error sending file to user: {e}")
-                    await event.respond(f"Error sending file: {file_name}")
-            
-            # Final success message
-            await bot.edit_message(processing_msg, f"All files sent successfully!\nTime taken: {time.time() - start_time:.2f} seconds")
-            
-            # Clean up downloaded files
-            for file_path in files:
+                # Final success message
+                await bot.edit_message(processing_msg, f"All files sent successfully!\nTime taken: {time.time() - start_time:.2f} seconds")
+            finally:
+                # Clean up temporary download directories once every user sharing this download is done (cached media is kept)
                 try:
-                    if os.path.exists(file_path):
-                        # Delete the parent directory containing the downloaded files
-                        parent_dir = os.path.dirname(file_path)
-                        shutil.rmtree(parent_dir, ignore_errors=True)
-                        logger.info(f"Cleaned up download directory: {parent_dir}")
-                        break  # We only need to delete the parent directory once
+                    download_pool.release(job)
                 except Exception as e:
                     logger.error(f"Error cleaning up files: {e}")
         
@@ -312,6 +621,8 @@ async def main():
         await bot.run_until_disconnected()
         
         # Cleanup on exit
+        await download_pool.shutdown()
+        downloader.close()
         db.close()
         logging.info("Bot has been stopped")
     except Exception as e:
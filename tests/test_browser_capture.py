@@ -0,0 +1,41 @@
+import json
+import unittest
+
+from browser_capture import NetworkCapture
+
+def response_event(url, mime_type, resource_type="Image", request_id="1"):
+    message = {"message": {
+        "method": "Network.responseReceived",
+        "params": {"requestId": request_id, "type": resource_type, "response": {"url": url, "mimeType": mime_type}}
+    }}
+    return {"message": json.dumps(message)}
+
+class FakeDriver:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_log(self, log_type):
+        entries, self.entries = self.entries, []
+        return entries
+
+class CdnMediaTest(unittest.TestCase):
+    def test_post_media_responses_are_recorded(self):
+        image = "https://scontent-ams2-1.cdninstagram.com/v/t51.2885-15/post_1080.jpg?oh=abc&oe=65"
+        video = "https://instagram.fams2-1.fna.fbcdn.net/o1/v/t16/f1/video.mp4?efg=xyz"
+        driver = FakeDriver([
+            response_event(image, "image/jpeg"),
+            response_event("https://scontent-ams2-1.cdninstagram.com/v/t51.2885-19/avatar.jpg", "image/jpeg"),
+            response_event(video + "&bytestart=0&byteend=1024", "video/mp4", "Media"),
+            response_event(video, "video/mp4", "Media"),
+            response_event(image, "image/jpeg"),
+            response_event("https://static.cdninstagram.com/rsrc.php/app.js", "text/javascript", "Script")
+        ])
+        capture = NetworkCapture(driver, "BENCHIMG001")
+
+        capture.poll()
+
+        self.assertIsNone(capture.media_urls)
+        self.assertEqual(capture.cdn_media_urls, [image, video])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from pymongo.errors import BulkWriteError
+
+import database
+
+def download_event(user_id, file_size, timestamp):
+    return {"timestamp": timestamp, "meta": {"kind": "download", "user_id": user_id}, "file_size": file_size}
+
+class InsertEventsTest(unittest.TestCase):
+    def setUp(self):
+        # Without MONGO_URI no connection or background threads are set up
+        with mock.patch.object(database.config, "MONGO_URI", ""):
+            self.db = database.Database()
+        self.db.events_collection = mock.Mock()
+        self.db.users_collection = mock.Mock()
+        # Counter updates come back as (filter, update) pairs to inspect
+        patcher = mock.patch.object(database, "UpdateOne", side_effect=lambda query, update, upsert: (query, update))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.batch = [
+            download_event("1", 100, datetime(2024, 1, 1, 10)),
+            download_event("1", 200, datetime(2024, 1, 1, 11)),
+            download_event("2", 300, datetime(2024, 1, 1, 12))
+        ]
+
+    def counter_updates(self):
+        self.assertEqual(self.db.users_collection.bulk_write.call_count, 1)
+        return {query["_id"]: update for query, update in self.db.users_collection.bulk_write.call_args[0][0]}
+
+    def test_counters_cover_only_inserted_events(self):
+        self.db.events_collection.insert_many.side_effect = BulkWriteError({
+            "writeErrors": [{"index": 1, "code": 2, "errmsg": "bad event"}],
+            "nInserted": 2
+        })
+
+        self.db._insert_events(self.batch)
+
+        updates = self.counter_updates()
+        self.assertEqual(updates["1"]["$inc"], {"downloads_count": 1, "bytes_delivered": 100})
+        self.assertEqual(updates["1"]["$max"], {"last_download": datetime(2024, 1, 1, 10)})
+        self.assertEqual(updates["2"]["$inc"], {"downloads_count": 1, "bytes_delivered": 300})
+
+    def test_failed_insert_leaves_counters_alone(self):
+        self.db.events_collection.insert_many.side_effect = ConnectionError("no primary")
+
+        self.db._insert_events(self.batch)
+
+        self.db.users_collection.bulk_write.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
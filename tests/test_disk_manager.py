@@ -0,0 +1,43 @@
+import os
+import tempfile
+import time
+import unittest
+
+from disk_manager import DiskManager
+
+class ReaperTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.disk = DiskManager(path=tmp.name, quota=0, lease_ttl=0.05, reap_interval=3600, tmpfs_path="")
+        self.addCleanup(self.disk.close)
+
+    def test_long_running_holder_keeps_its_directory(self):
+        directory = self.disk.lease()
+        media_file = os.path.join(directory, "video.mp4")
+        with open(media_file, 'wb') as f:
+            f.write(b"x" * 1024)
+        self.disk.charge(media_file, 1024)
+
+        # Still sending long after the lease time
+        time.sleep(0.2)
+        self.disk.reap()
+
+        self.assertTrue(os.path.exists(media_file))
+        self.assertEqual(self.disk.reaped, 0)
+        self.assertTrue(self.disk.release(directory))
+        self.assertFalse(os.path.exists(directory))
+
+    def test_abandoned_directory_is_reaped(self):
+        leftover = os.path.join(self.disk.path, "left-by-crash")
+        os.makedirs(leftover)
+        old = time.time() - 60
+        os.utime(leftover, (old, old))
+
+        self.disk.reap()
+
+        self.assertFalse(os.path.exists(leftover))
+        self.assertEqual(self.disk.reaped, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from hedging import run_in_attempt
+from http_client import HttpClient
+
+MEDIA_URL = "https://scontent.cdninstagram.com/v/t50/video.mp4"
+
+class SlowResponse:
+    """Streamed 200 response that hands out its body one small chunk at a time"""
+    def __init__(self, chunks, delay=0.01):
+        self.status_code = 200
+        self.chunks = chunks
+        self.delay = delay
+        self.sent = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for _ in range(self.chunks):
+            time.sleep(self.delay)
+            self.sent += 1
+            yield b"x" * 16
+
+    def close(self):
+        self.closed = True
+
+class FetchCancellationTest(unittest.TestCase):
+    def setUp(self):
+        self.client = HttpClient(fetch_workers=2)
+        self.addCleanup(self.client.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def test_losing_attempt_stops_its_fetches(self):
+        response = SlowResponse(chunks=500)
+        cancel_event = threading.Event()
+        output_file = os.path.join(self.dir, "video.mp4")
+
+        def lose_race():
+            while response.sent < 3:
+                time.sleep(0.005)
+            cancel_event.set()
+
+        loser = threading.Thread(target=lose_race)
+        with mock.patch.object(self.client.session, "request", return_value=response):
+            loser.start()
+            files = run_in_attempt(cancel_event, self.client.fetch_all, [(MEDIA_URL, output_file)])
+            loser.join()
+
+        self.assertEqual(files, [])
+        self.assertLess(response.sent, 50)
+        self.assertTrue(response.closed)
+        self.assertFalse(os.path.exists(output_file))
+
+    def test_cancelled_attempt_sends_no_requests(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        output_file = os.path.join(self.dir, "video.mp4")
+        with mock.patch.object(self.client.session, "request", return_value=SlowResponse(chunks=1)) as request:
+            files = run_in_attempt(cancel_event, self.client.fetch_all, [(MEDIA_URL, output_file)])
+            probes = run_in_attempt(cancel_event, self.client.probe_all, [MEDIA_URL])
+
+        self.assertEqual(files, [])
+        self.assertEqual(probes, [False])
+        self.assertEqual(request.call_count, 0)
+
+if __name__ == "__main__":
+    unittest.main()
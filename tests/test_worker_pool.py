@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import unittest
+
+from media_stream import RemoteMedia
+from worker_pool import DownloadPool
+
+POST_URL = "https://www.instagram.com/reel/BENCHVID001/"
+
+class FakeRateLimiter:
+    async def wait_ready(self, url):
+        pass
+
+class FakeDownloader:
+    """Stands in for InstagramDownloader; download blocks until release is set"""
+    def __init__(self):
+        self.rate_limiter = FakeRateLimiter()
+        self.release = threading.Event()
+        self.downloads = 0
+        self.cleaned = []
+
+    def download(self, url, stream=False):
+        self.downloads += 1
+        self.release.wait(5)
+        if stream:
+            return [RemoteMedia("/tmp/video.mp4", "https://scontent.cdninstagram.com/video.mp4")]
+        return ["/tmp/video.mp4"]
+
+    def cleanup(self, files):
+        self.cleaned.append(files)
+
+class DownloadPoolTest(unittest.TestCase):
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 10))
+
+    def test_coalesced_stream_job_shares_its_media(self):
+        async def scenario():
+            downloader = FakeDownloader()
+            pool = DownloadPool(downloader, workers=1, queue_size=4)
+            try:
+                first = await pool.submit(POST_URL, stream=True)
+                second = await pool.submit(POST_URL, stream=True)
+                downloader.release.set()
+                return downloader, first, await first, await second
+            finally:
+                await pool.shutdown()
+
+        downloader, job, first_files, second_files = self.run_async(scenario())
+        self.assertEqual(downloader.downloads, 1)
+        self.assertEqual(job.waiters, 2)
+        self.assertIs(first_files[0], second_files[0])
+        self.assertTrue(first_files[0].shared)
+
+    def test_single_stream_job_streams(self):
+        async def scenario():
+            downloader = FakeDownloader()
+            downloader.release.set()
+            pool = DownloadPool(downloader, workers=1, queue_size=4)
+            try:
+                return await (await pool.submit(POST_URL, stream=True))
+            finally:
+                await pool.shutdown()
+
+        files = self.run_async(scenario())
+        self.assertFalse(files[0].shared)
+
+    def test_shutdown_fails_pending_jobs(self):
+        async def scenario():
+            downloader = FakeDownloader()
+            pool = DownloadPool(downloader, workers=1, queue_size=4)
+            running = await pool.submit(POST_URL)
+            queued = await pool.submit("https://www.instagram.com/p/BENCHIMG001/")
+            # Let the worker pick up the first job
+            while running.started_at is None:
+                await asyncio.sleep(0.01)
+            await pool.shutdown()
+            downloader.release.set()
+            results = await asyncio.gather(running, queued, return_exceptions=True)
+            return pool, results
+
+        pool, results = self.run_async(scenario())
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+        self.assertEqual(pool.stats()["in_flight"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+from downloader import extract_shortcode
+from media_stream import RemoteMedia
+
+def request_key(url):
+    """Key that identifies requests for the same post, whatever the link looks like"""
+    shortcode = extract_shortcode(url)
+    return f"post:{shortcode}" if shortcode else url.split('?')[0].rstrip('/')
+
+class DownloadJob:
+    """
+    Awaitable handle for a download submitted to the pool.
+    One job can be shared by several requests for the same post; waiters counts them.
+    """
+    def __init__(self, url, stream=False):
+        self.url = url
+        self.stream = stream
+        self.key = request_key(url)
+        self.waiters = 1
+        self.future = asyncio.get_running_loop().create_future()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    def __await__(self):
+        # Shield the shared future so a cancelled waiter doesn't cancel the job itself
+        return asyncio.shield(self.future).__await__()
+
+    def done(self):
+        """Check whether the job has finished"""
+        return self.future.done()
+
+    @property
+    def wait_time(self):
+        """Seconds the job spent in the queue before a worker picked it up"""
+        if self.started_at is None:
+            return time.monotonic() - self.submitted_at
+        return self.started_at - self.submitted_at
+
+    @property
+    def run_time(self):
+        """Seconds the job has been (or was) running on a worker"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+class DownloadPool:
+    """
+    Runs InstagramDownloader.download off the event loop.
+    Jobs go through a bounded queue and are executed by a fixed number of
+    workers backed by a thread pool. The workers share the one downloader, so
+    its media cache, rate limits, sessions and browsers are shared as well.
+    Requests for a post that is already queued or downloading attach to the
+    existing job instead of downloading it again.
+    """
+    def __init__(self, downloader, workers=None, queue_size=None):
+        self.downloader = downloader
+        self.workers = workers or config.DOWNLOAD_WORKERS
+        self.queue_size = queue_size if queue_size is not None else config.DOWNLOAD_QUEUE_SIZE
+        self.executor = None
+        self.queue = None
+        self.running = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._worker_tasks = []
+
+    def start(self):
+        """Create the executor and worker tasks (must be called from the running loop)"""
+        if self.queue is not None:
+            return
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Download pool started with {self.workers} workers")
+
+    async def submit(self, url, stream=False):
+        """
+        Queue a download and return an awaitable DownloadJob (waits while the queue is full).
+        If the same post is already being downloaded, its job is returned instead.
+        With stream=True, CDN media may come back as RemoteMedia to be streamed by the caller.
+        Every submit must be matched by a release once the files have been delivered.
+        """
+        self.start()
+        key = (request_key(url), stream)
+        job = self._inflight.get(key)
+        if job is not None and not job.done():
+            job.waiters += 1
+            self.coalesced += 1
+            logging.info(f"Attached request for {url} to in-flight download ({job.waiters} waiters)")
+            return job
+
+        job = DownloadJob(url, stream)
+        self._inflight[key] = job
+        try:
+            await self.queue.put(job)
+        except BaseException:
+            self._forget(job)
+            raise
+        logging.info(f"Queued download for {url} (queue depth: {self.queue.qsize()})")
+        return job
+
+    def _forget(self, job):
+        """Stop attaching new requests to a job"""
+        key = (job.key, job.stream)
+        if self._inflight.get(key) is job:
+            del self._inflight[key]
+
+    def release(self, job):
+        """Give up one waiter's hold on a job's files; the last waiter cleans up the temporary downloads"""
+        job.waiters -= 1
+        if job.waiters > 0:
+            return
+        if not job.future.done():
+            # The last waiter gave up before the download finished; clean up once it does
+            job.future.add_done_callback(lambda future: self._cleanup(job))
+            return
+        self._cleanup(job)
+
+    def _cleanup(self, job):
+        """Delete a finished job's temporary downloads unless a new request attached to it meanwhile"""
+        if job.waiters > 0 or job.future.cancelled() or job.future.exception():
+            return
+        files = job.future.result()
+        if files:
+            self.downloader.cleanup(files)
+
+    async def _worker(self):
+        """Take jobs from the queue and run them on the executor"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.future.done():
+                    continue
+
+                # Wait out Instagram's rate limit here instead of parking an executor thread
+                await self.downloader.rate_limiter.wait_ready(job.url)
+
+                job.started_at = time.monotonic()
+                self.running += 1
+                try:
+                    files = await loop.run_in_executor(self.executor, self.downloader.download, job.url, job.stream)
+                    if job.stream and job.waiters > 1:
+                        # Requests attached to this job fetch its CDN files once instead of each streaming them
+                        for media in files or []:
+                            if isinstance(media, RemoteMedia):
+                                media.shared = True
+                    if not job.future.done():
+                        job.future.set_result(files)
+                except Exception as e:
+                    logging.error(f"Download job for {job.url} failed: {e}")
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                finally:
+                    self.running -= 1
+                    job.finished_at = time.monotonic()
+                    self._forget(job)
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        """Get current queue and worker statistics"""
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "in_flight": len(self._inflight),
+            "coalesced": self.coalesced
+        }
+
+    async def shutdown(self):
+        """Stop the workers and release the executor; requests still waiting on a job get an error"""
+        # Queued and running jobs would otherwise never finish (a cancelled worker forgets its job)
+        pending = list(self._inflight.values())
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for job in pending:
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Download pool was shut down"))
+        self._inflight.clear()
+        self.queue = None
+
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        logging.info("Download pool stopped")
@@ -0,0 +1,85 @@
+import logging
+import threading
+import yt_dlp
+from media_manifest import MediaManifest
+
+class YtdlpResolver:
+    """
+    Uses yt-dlp only to resolve a post's media URLs; the bytes are fetched
+    by our own pooled HTTP client.
+
+    YoutubeDL instances are quiet and long-lived: one per worker thread and
+    account (they aren't thread-safe), rebuilt only when the account's
+    cookies change.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    def _options(self, session):
+        return {
+            'format': 'best',
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': False,
+            'cookiefile': session.cookie_file if session else None,
+            'socket_timeout': 30,
+            'retries': 5
+        }
+
+    def _instance(self, session):
+        """Get this thread's YoutubeDL for an account (or anonymous for session=None)"""
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+
+        key = session.username if session else None
+        cookies = session.cookies if session else None
+        entry = instances.get(key)
+        if entry is None or entry[1] is not cookies:
+            ydl = yt_dlp.YoutubeDL(self._options(session))
+            with self._lock:
+                if entry is not None:
+                    self._instances.remove(entry[0])
+                self._instances.append(ydl)
+            if entry is not None:
+                entry[0].close()
+            entry = instances[key] = (ydl, cookies)
+        return entry[0]
+
+    def resolve(self, url, session=None):
+        """
+        Resolve the media of a post without downloading it.
+        Returns the manifest and the HTTP headers yt-dlp would send to fetch it.
+        yt-dlp errors (e.g. HTTP 401/429) are raised, so callers can back off.
+        """
+        manifest = MediaManifest()
+        headers = {}
+
+        info = self._instance(session).extract_info(url, download=False)
+        if not info:
+            return manifest, headers
+
+        # Carousels come back as playlists with one entry per item
+        entries = info.get('entries') if info.get('_type') in ('playlist', 'multi_video') else [info]
+        for entry in entries or []:
+            if not entry or not entry.get('url'):
+                continue
+            kind = "image" if entry.get('vcodec') == 'none' else "video"
+            manifest.add(entry['url'], kind=kind, source='ytdlp')
+            headers = headers or entry.get('http_headers', {})
+
+        logging.info(f"yt-dlp resolved {len(manifest)} media URLs")
+        return manifest, headers
+
+    def close(self):
+        """Close every YoutubeDL instance"""
+        with self._lock:
+            instances = list(self._instances)
+            self._instances.clear()
+        for ydl in instances:
+            try:
+                ydl.close()
+            except Exception:
+                pass